@@ -1,47 +1,217 @@
 import os
 import json
-from pymongo import MongoClient
-from bson import ObjectId
+import base64
+import datetime
+from collections import Counter
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import BulkWriteError
+from bson import Decimal128, MaxKey, MinKey, ObjectId, Timestamp, json_util
+
+from atlas_client import create_client
+from serializer import dumps
+from stage_timing import timer
+from structured_log import StructuredLog
 
 ATLAS_CONNECTION_STRING = os.environ['ATLAS_CONN_STR']
 DB_NAME = os.environ['DB_NAME']
 COLLECTION = os.environ['COLLECTION']
-client = MongoClient(ATLAS_CONNECTION_STRING)
+# find_many pages: documents per page, cursor batch size and the largest response body in bytes
+FIND_MANY_PAGE_SIZE = int(os.environ.get('FIND_MANY_PAGE_SIZE', '20'))
+FIND_MANY_BATCH_SIZE = int(os.environ.get('FIND_MANY_BATCH_SIZE', '20'))
+FIND_MANY_MAX_BYTES = int(os.environ.get('FIND_MANY_MAX_BYTES', '20000'))
+# Projection used when the agent does not send one, keeps embeddings out of the response
+DEFAULT_PROJECTION = json.loads(os.environ.get('DEFAULT_PROJECTION', '{"details_embedding": 0, "plot_embedding": 0}'))
+client = create_client(ATLAS_CONNECTION_STRING)
+log = StructuredLog("crud")
+
+
+def to_write_model(operation):
+    """
+    Convert one bulk_write operation sent by the agent into a pymongo write model, e.g.
+    {"insert_one": {"document": {...}}}, {"update_one": {"filter": {...}, "update": {...}, "upsert": false}},
+    {"replace_one": {"filter": {...}, "replacement": {...}}} or {"delete_many": {"filter": {...}}}
+    """
+    if not isinstance(operation, dict) or len(operation) != 1:
+        raise ValueError("Each operation must be an object with exactly one key")
+    (name, args), = operation.items()
+    if not isinstance(args, dict):
+        raise ValueError("The arguments of {} must be an object".format(name))
+    if name == "insert_one":
+        return InsertOne(args["document"])
+    if name == "update_one":
+        return UpdateOne(args["filter"], args["update"], upsert=args.get("upsert", False))
+    if name == "update_many":
+        return UpdateMany(args["filter"], args["update"], upsert=args.get("upsert", False))
+    if name == "replace_one":
+        return ReplaceOne(args["filter"], args["replacement"], upsert=args.get("upsert", False))
+    if name == "delete_one":
+        return DeleteOne(args["filter"])
+    if name == "delete_many":
+        return DeleteMany(args["filter"])
+    raise ValueError("Unknown operation {}".format(name))
+
+
+# $type aliases of each BSON type class in sort order. Range operators only
+# match values of the queried type class, so paging past a sort value also
+# selects the classes sorting after it; null covers missing fields too.
+BSON_SORT_ORDER = [["minKey"], ["null"], ["double", "int", "long", "decimal"], ["string", "symbol"], ["object"],
+                   ["array"], ["binData"], ["objectId"], ["bool"], ["date"], ["timestamp"], ["regex"], ["maxKey"]]
+
+
+def sort_rank(value):
+    """
+    Position of `value`'s type class in BSON_SORT_ORDER
+    """
+    if isinstance(value, MinKey):
+        return 0
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float, Decimal128)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime.datetime):
+        return 9
+    if isinstance(value, Timestamp):
+        return 10
+    if isinstance(value, MaxKey):
+        return 12
+    # Arrays sort by their smallest or largest element and a regex in a filter
+    # matches instead of comparing, neither can mark a page boundary
+    raise ValueError("Cannot page on a sort field holding {}".format(type(value).__name__))
+
+
+def encode_token(sort_field, direction, doc):
+    value = doc.get(sort_field)
+    if sort_field != "_id":
+        sort_rank(value)
+    position = {"field": sort_field, "direction": direction, "value": value, "_id": doc["_id"]}
+    return base64.urlsafe_b64encode(json_util.dumps(position).encode("utf-8")).decode("ascii")
 
+
+def decode_token(token):
+    return json_util.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+
+
+def keyset_filter(sort_field, direction, position):
+    """
+    Filter selecting the documents after `position` in (sort_field, _id) order,
+    including those whose sort field is missing, null or of another type
+    """
+    op = "$gt" if direction == 1 else "$lt"
+    if sort_field == "_id":
+        return {"_id": {op: position["_id"]}}
+    value = position["value"]
+    rank = sort_rank(value)
+    branches = [{sort_field: value, "_id": {op: position["_id"]}}]
+    if rank not in (0, 1, 12):
+        branches.append({sort_field: {op: value}})
+    later = BSON_SORT_ORDER[rank + 1:] if direction == 1 else BSON_SORT_ORDER[:rank]
+    aliases = [alias for group in later for alias in group if alias != "null"]
+    if aliases:
+        branches.append({sort_field: {"$type": aliases}})
+    if direction == -1 and rank > 1:
+        branches.append({sort_field: None})
+    return {"$or": branches}
+
+
+def page_projection(projection_obj, sort_field):
+    """
+    The requested projection (or the default one), always returning the sort
+    field and _id, which the continuation token is built from
+    """
+    projection = dict(projection_obj) if len(projection_obj) > 0 else dict(DEFAULT_PROJECTION)
+    if projection.get("_id") in (0, False):
+        del projection["_id"]
+    if projection.get(sort_field) == 0:
+        del projection[sort_field]
+    elif any(value not in (0, False) for key, value in projection.items() if key != "_id"):
+        projection[sort_field] = 1
+    return projection or None
+
+
+def write_counts(result):
+    return "inserted: {}, matched: {}, modified: {}, deleted: {}, upserted: {}".format(
+        result["nInserted"], result["nMatched"], result["nModified"], result["nRemoved"], result["nUpserted"])
+
+@timer.flush_after
 def lambda_handler(event, context):
     agent = event['agent']
     actionGroup = event['actionGroup']
-    print("Action Group: ", actionGroup)
     function = event['function']
     parameters = event.get('parameters', [])
-    print("Parameters: ", parameters)
+    log.info("Request", action_group=actionGroup, function=function, parameters=parameters)
 
     def insert_one(params):
-        return client[DB_NAME][COLLECTION].insert_one(params)
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].insert_one(params)
     
     def insert_many(params):
-        return client[DB_NAME][COLLECTION].insert_many(params)
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].insert_many(params)
 
     def find_one(params):
-        return client[DB_NAME][COLLECTION].find_one(params)
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].find_one(params)
 
-    def find_many(filter_obj, projection_obj={}):
-        if len(projection_obj) > 0:
-            return list(client[DB_NAME][COLLECTION].find(filter_obj, projection_obj))
-        else:
-            return list(client[DB_NAME][COLLECTION].find(filter_obj))
+    def find_many(filter_obj, projection_obj={}, sort_field="_id", direction=1, page_size=FIND_MANY_PAGE_SIZE,
+                  batch_size=FIND_MANY_BATCH_SIZE, max_bytes=FIND_MANY_MAX_BYTES, continuation_token=None):
+        """
+        Return one page of serialized documents in (sort_field, _id) order and
+        the token of the next page, None on the last page. The cursor stops as soon as
+        page_size documents are read or the next one would exceed max_bytes
+        """
+        if continuation_token:
+            position = decode_token(continuation_token)
+            sort_field, direction = position["field"], position["direction"]
+            filter_obj = {"$and": [filter_obj, keyset_filter(sort_field, direction, position)]}
+        sort = [(sort_field, direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+        cursor = client[DB_NAME][COLLECTION].find(filter_obj, page_projection(projection_obj, sort_field),
+                                                   sort=sort, limit=page_size + 1, batch_size=batch_size)
+        # _id is always read for the token, and left out of the page when the agent excluded it
+        hide_id = projection_obj.get("_id") in (0, False) and sort_field != "_id"
+        docs, parts, size, more = [], [], 0, False
+        # find() is lazy, so the first batch is fetched (and timed) with the rest of the page
+        with cursor, timer.stage("cursor") as stage:
+            for doc in cursor:
+                part = dumps({key: value for key, value in doc.items() if key != "_id"} if hide_id else doc)
+                if len(docs) == page_size or (docs and size + len(part) > max_bytes):
+                    more = True
+                    break
+                docs.append(doc)
+                parts.append(part)
+                size += len(part)
+            stage.count, stage.bytes = len(docs), size
+        next_token = encode_token(sort_field, direction, docs[-1]) if more else None
+        return parts, next_token
 
     def delete_one(params):
-        return client[DB_NAME][COLLECTION].delete_one(params)
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].delete_one(params)
     
     def delete_many(params):
-        return client[DB_NAME][COLLECTION].delete_many(params)
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].delete_many(params)
     
     def update_one(filter_obj, update_obj):
-        return client[DB_NAME][COLLECTION].update_one(filter_obj, update_obj)
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].update_one(filter_obj, update_obj)
     
     def update_many(filter_obj, update_obj):
-        return client[DB_NAME][COLLECTION].update_many(filter_obj, update_obj)
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].update_many(filter_obj, update_obj)
+
+    def bulk_write(operations):
+        with timer.stage("query"):
+            return client[DB_NAME][COLLECTION].bulk_write([to_write_model(op) for op in operations], ordered=False)
 
     # Extracting values from the params
     param_dict = {param['name'].lower(): (int(param['value']) if param['type'] == "number" else param['value']) for param in parameters}
@@ -51,7 +221,7 @@ def lambda_handler(event, context):
         if len(json_obj) > 0:
             try:
                 result = insert_one(json_obj)
-                result_txt = "Record added successfully"
+                result_txt = "Record added with _id {}".format(result.inserted_id)
             except ValueError:
                 result_txt = "Error: Some issue with the parameter type"
         else:
@@ -66,7 +236,9 @@ def lambda_handler(event, context):
         if json_obj is not None:
             result = find_one(json_obj)
             if result is not None:
-                result_txt = "Record found: {}".format(result)
+                with timer.stage("format") as stage:
+                    result_txt = "Record found: {}".format(dumps(result))
+                    stage.bytes = len(result_txt)
             else:
                 result_txt = "No record found"
         else:
@@ -80,8 +252,8 @@ def lambda_handler(event, context):
     elif function == "delete_one":
         if json_obj is not None:
             result = delete_one(json_obj)
-            if result is not None:
-                result_txt = "Record deleted successfully"
+            if result.deleted_count > 0:
+                result_txt = "Deleted {} record".format(result.deleted_count)
             else:
                 result_txt = "No record found"
         else:
@@ -95,10 +267,9 @@ def lambda_handler(event, context):
     elif function == "update_one":
         if 'filter' in json_obj and 'update' in json_obj:
             try:
-                record_exists = find_one(json_obj['filter'])
-                if record_exists is not None:
-                    result = update_one(json_obj['filter'], json_obj['update'])
-                    result_txt = "Record updated successfully"
+                result = update_one(json_obj['filter'], json_obj['update'])
+                if result.matched_count > 0:
+                    result_txt = "Record updated, matched: {}, modified: {}".format(result.matched_count, result.modified_count)
                 else:
                     result_txt = "Record not found"
             except ValueError:
@@ -111,11 +282,11 @@ def lambda_handler(event, context):
                 "body": result_txt
             }
         }
-    if function == "insert_many":
+    elif function == "insert_many":
         if json_obj is not None:
             try:
                 result = insert_many(json_obj)
-                result_txt = "Records added successfully"
+                result_txt = "Added {} records".format(len(result.inserted_ids))
             except ValueError:
                 result_txt = "Error: Some issue with the parameter type"
         else:
@@ -129,11 +300,28 @@ def lambda_handler(event, context):
     elif function == "find_many":
         projection_obj = json_obj['projection'] if 'projection' in json_obj else {}
         if 'filter' in json_obj:
-            result = find_many(json_obj['filter'], projection_obj)
-            if result is not None:
-                result_txt = "Record found: {}".format(result)
-            else:
-                result_txt = "No records found"
+            sort_obj = json_obj.get('sort', {"_id": 1})
+            sort_field, direction = next(iter(sort_obj.items())) if isinstance(sort_obj, dict) else (sort_obj, 1)
+            try:
+                page_size = min(int(json_obj.get('page_size', FIND_MANY_PAGE_SIZE)), FIND_MANY_PAGE_SIZE)
+                batch_size = int(json_obj.get('batch_size', FIND_MANY_BATCH_SIZE))
+                if page_size < 1 or batch_size < 0:
+                    raise ValueError("page_size must be at least 1 and batch_size not negative")
+                result, next_token = find_many(
+                    json_obj['filter'], projection_obj, sort_field, int(direction),
+                    page_size=page_size, batch_size=batch_size,
+                    max_bytes=min(int(json_obj.get('max_bytes', FIND_MANY_MAX_BYTES)), FIND_MANY_MAX_BYTES),
+                    continuation_token=json_obj.get('continuation_token'))
+                if len(result) > 0:
+                    with timer.stage("format") as stage:
+                        result_txt = "Record found: [{}]".format(",".join(result))
+                        stage.bytes = len(result_txt)
+                    if next_token:
+                        result_txt += "\nMore records available, pass continuation_token: {}".format(next_token)
+                else:
+                    result_txt = "No records found"
+            except (ValueError, TypeError):
+                result_txt = "Error: Some issue with the parameter type"
         else:
             result_txt = "Missing param"
         
@@ -145,8 +333,8 @@ def lambda_handler(event, context):
     elif function == "delete_many":
         if json_obj is not None:
             result = delete_many(json_obj)
-            if result is not None:
-                result_txt = "Record deleted successfully"
+            if result.deleted_count > 0:
+                result_txt = "Deleted {} records".format(result.deleted_count)
             else:
                 result_txt = "No records found"
         else:
@@ -161,12 +349,33 @@ def lambda_handler(event, context):
         if 'filter' in json_obj and 'update' in json_obj:
             try:
                 result = update_many(json_obj['filter'], json_obj['update'])
-                result_txt = "Records updated successfully"
+                result_txt = "Records updated, matched: {}, modified: {}".format(result.matched_count, result.modified_count)
             except ValueError:
                 result_txt = "Error: Some issue with the parameter type"
         else:
             result_txt = "Missing param"
 
+        responseBody = {
+            "TEXT": {
+                "body": result_txt
+            }
+        }
+    elif function == "bulk_write":
+        if isinstance(json_obj, list) and len(json_obj) > 0:
+            try:
+                result = bulk_write(json_obj)
+                operations = Counter(name for op in json_obj for name in op)
+                result_txt = "Bulk write of {} operations ({}) done, {}".format(
+                    len(json_obj), dict(operations), write_counts(result.bulk_api_result))
+            except (ValueError, KeyError, TypeError) as e:
+                # TypeError: pymongo rejecting a document or filter that is not an object
+                result_txt = "Error: Invalid operation: {}".format(e)
+            except BulkWriteError as e:
+                result_txt = "Bulk write partially failed with {} errors, {}".format(
+                    len(e.details["writeErrors"]), write_counts(e.details))
+        else:
+            result_txt = "Missing param"
+
         responseBody = {
             "TEXT": {
                 "body": result_txt
@@ -189,6 +398,7 @@ def lambda_handler(event, context):
     }
 
     dummy_function_response = {'response': action_response, 'messageVersion': event['messageVersion']}
-    print("Response: {}".format(dummy_function_response))
+    log.info("Response", action_group=actionGroup, function=function,
+             body_chars=len(responseBody["TEXT"]["body"]), body=responseBody["TEXT"]["body"])
 
     return dummy_function_response
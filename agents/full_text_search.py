@@ -1,34 +1,53 @@
 import os
 import json
-from pymongo import MongoClient
 from bson import ObjectId
 
+from atlas_client import create_client
+from serializer import dumps
+from stage_timing import timer
+from structured_log import StructuredLog
+
 ATLAS_CONNECTION_STRING = os.environ['ATLAS_CONN_STR']
 DB_NAME = os.environ['DB_NAME']
 COLLECTION = os.environ['COLLECTION']
 SEARCH_INDEX = os.environ['SEARCH_INDEX']
-client = MongoClient(ATLAS_CONNECTION_STRING)
+# Read name and address from the search index's stored source instead of the
+# collection; the index must store name, address and borough
+STORED_SOURCE = os.environ.get('STORED_SOURCE', 'false').lower() == 'true'
+client = create_client(ATLAS_CONNECTION_STRING)
+log = StructuredLog("full_text_search")
 
+@timer.flush_after
 def lambda_handler(event, context):
     agent = event['agent']
     actionGroup = event['actionGroup']
     function = event['function']
     parameters = event.get('parameters', [])
 
-    # Function to search restaurants based on the keyword
-    def search_restaurants(keyword, limiter=5):
+    # Function to search restaurants based on the keyword, resuming after the
+    # searchSequenceToken of the last restaurant of the previous page
+    def search_restaurants(keyword, limiter=5, page_token=None):
+        search = {
+            "index": SEARCH_INDEX,
+            "text": {
+                "query": keyword,
+                "path": {
+                    "wildcard": "*"
+                }
+            }
+        }
+        if page_token:
+            search["searchAfter"] = page_token
+        if STORED_SOURCE:
+            search["returnStoredSource"] = True
+        # $search already returns the hits by score, so $limit comes straight
+        # after it and only the page is looked up and projected
         search_stage = [
             {
-                "$search":
-                {
-                    "index": SEARCH_INDEX,
-                    "text": {
-                        "query": keyword,
-                        "path": {
-                            "wildcard": "*"
-                        }
-                    }
-                }
+                "$search": search
+            },
+            {
+                "$limit": limiter
             },
             {
                 "$project":
@@ -47,19 +66,15 @@ def lambda_handler(event, context):
                             "$address.zipcode"
                         ]
                     },
-                    "score": { "$meta": "searchScore" }
-                }
-            },
-            {
-                "$sort": {
-                    "score": -1
+                    "score": { "$meta": "searchScore" },
+                    "page_token": { "$meta": "searchSequenceToken" }
                 }
-            },
-            {
-                "$limit": limiter
             }
         ]
-        return list(client[DB_NAME][COLLECTION].aggregate(search_stage))
+        restaurants = timer.fetch(lambda: client[DB_NAME][COLLECTION].aggregate(search_stage))
+        tokens = [restaurant.pop("page_token", None) for restaurant in restaurants]
+        # A full page may have more restaurants after it
+        return restaurants, tokens[-1] if len(restaurants) == limiter else None
 
     # Extracting values from the params
     param_dict = {param['name'].lower(): (int(param['value']) if param['type'] == "number" else param['value']) for param in parameters}
@@ -69,8 +84,12 @@ def lambda_handler(event, context):
         keyword, limiter = param_dict.get("keyword"), param_dict.get("limiter", 5)
         if keyword is not None:
             try:
-                result = search_restaurants(keyword, limiter)
-                result_txt = "List of Restaurants: \n{}".format(result)
+                result, next_page = search_restaurants(keyword, limiter, param_dict.get("page_token"))
+                with timer.stage("format") as stage:
+                    result_txt = "List of Restaurants: \n{}".format(dumps(result))
+                    if next_page:
+                        result_txt += "\nFor more restaurants, call again with page_token: {}".format(next_page)
+                    stage.bytes = len(result_txt)
             except ValueError:
                 result_txt = "Error: Some issue with the keyword parameter type"
         else:
@@ -98,6 +117,7 @@ def lambda_handler(event, context):
     }
 
     dummy_function_response = {'response': action_response, 'messageVersion': event['messageVersion']}
-    print("Response: {}".format(dummy_function_response))
+    log.info("Response", action_group=actionGroup, function=function,
+             body_chars=len(responseBody["TEXT"]["body"]), body=responseBody["TEXT"]["body"])
 
     return dummy_function_response
@@ -1,17 +1,31 @@
 import os
 import json
-from pymongo import MongoClient
 from bson import ObjectId
 import boto3 
 
+from atlas_client import create_client
+from embeddings import EmbeddingCache, embed_titan, TITAN_MODEL_ID
+from semantic_cache import SemanticCache
+from search_settings import num_candidates
+from vector_codec import encode_vector
+from serializer import dumps
+from stage_timing import timer
+from structured_log import StructuredLog
+
 ATLAS_CONNECTION_STRING = os.environ['ATLAS_CONN_STR']
 DB_NAME = os.environ['DB_NAME']
 COLLECTION = os.environ['COLLECTION']
 SEARCH_INDEX = os.environ['SEARCH_INDEX']
 VECTOR_FIELD = os.environ['VECTOR_FIELD']
-client = MongoClient(ATLAS_CONNECTION_STRING)
+# numCandidates used when tune_num_candidates.py has no setting for the collection
+NUM_CANDIDATES = int(os.environ.get('NUM_CANDIDATES', '100'))
+client = create_client(ATLAS_CONNECTION_STRING)
+log = StructuredLog("vector_search")
 bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
+embedding_cache = EmbeddingCache.from_env(lambda: client)
+result_cache = SemanticCache.from_env()
 
+@timer.flush_after
 def lambda_handler(event, context):
     agent = event['agent']
     actionGroup = event['actionGroup']
@@ -25,8 +39,8 @@ def lambda_handler(event, context):
                 "$vectorSearch": {
                     "index": SEARCH_INDEX,
                     "path": VECTOR_FIELD,
-                    "queryVector": query_vector,
-                    "numCandidates": 100,
+                    "queryVector": encode_vector(query_vector),
+                    "numCandidates": num_candidates(f"{DB_NAME}.{COLLECTION}", limiter, NUM_CANDIDATES),
                     "limit": limiter
                 }
             },
@@ -38,24 +52,29 @@ def lambda_handler(event, context):
             } 
         ]
 
-        return list(client[DB_NAME][COLLECTION].aggregate(agg_pipeline))
+        # Rephrasings of a recent query reuse its results instead of searching again
+        return result_cache.get(
+            query_vector,
+            lambda vector: timer.fetch(lambda: client[DB_NAME][COLLECTION].aggregate(agg_pipeline)),
+            scope=(SEARCH_INDEX, VECTOR_FIELD, limiter),
+        )
 
 
     param_dict = {param['name'].lower(): (int(param['value']) if param['type'] == "number" else param['value']) for param in parameters}
     query, limiter = param_dict.get("query"), param_dict.get("limiter", 5)
-    response = bedrock_runtime.invoke_model(
-        modelId="amazon.titan-embed-text-v1",
-        body=json.dumps({"inputText": query}),
-        contentType="application/json",
-        accept="application/json"
-    )
-
-    query_vector = json.loads(response['body'].read()).get("embedding")
+    query_vector = None
+    if query is not None:
+        with timer.stage("embedding"):
+            query_vector = embedding_cache.get(TITAN_MODEL_ID, query, lambda text: embed_titan(bedrock_runtime, text))
+        log.info("Embedding cache", stats=embedding_cache.stats)
 
     if query is not None and query_vector:
         try:
             result = vector_search(query, limiter)
-            result_txt = "Vector Search Results: \n{}".format(result)
+            log.info("Semantic cache", stats=result_cache.stats)
+            with timer.stage("format") as stage:
+                result_txt = "Vector Search Results: \n{}".format(dumps(result))
+                stage.bytes = len(result_txt)
         except ValueError:
             result_txt = "Error: Issue with query or vector parameter type"
     else:
@@ -78,6 +97,7 @@ def lambda_handler(event, context):
     }
 
     dummy_function_response = {'response': action_response, 'messageVersion': event['messageVersion']}
-    print("Response: {}".format(dummy_function_response))
+    log.info("Response", action_group=actionGroup, function=function,
+             body_chars=len(responseBody["TEXT"]["body"]), body=responseBody["TEXT"]["body"])
 
     return dummy_function_response
@@ -0,0 +1,69 @@
+import argparse
+import logging
+import os
+import sys
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared'))
+from embedding_backfill import AdaptiveBackoff, EmbeddingBackfill, StubEmbedder, TitanEmbedder
+from embeddings import TITAN_MODEL_ID
+from vector_codec import VECTOR_ENCODINGS
+from atlas_client import get_secret
+
+logger = logging.getLogger('backfill_embeddings')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Embed the documents that have no embedding or whose text changed since it was computed")
+    parser.add_argument("--db", default="travel")
+    parser.add_argument("--collection", default="asia")
+    parser.add_argument("--source-field", default="About Place", help="Field holding the text to embed")
+    parser.add_argument("--field", default="details_embedding", help="Field the embeddings are written to")
+    parser.add_argument("--embedder", choices=["titan", "stub"], default="titan",
+                        help="Bedrock Titan, or deterministic local vectors for trying the pipeline out")
+    parser.add_argument("--model-id", default=TITAN_MODEL_ID)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Dimensions of the stub vectors")
+    parser.add_argument("--workers", type=int, default=4, help="Embedding batches in flight")
+    parser.add_argument("--batch-size", type=int, default=8, help="Distinct texts per embedding batch")
+    parser.add_argument("--write-batch", type=int, default=500, help="Updates per bulk write")
+    parser.add_argument("--vector-encoding", choices=VECTOR_ENCODINGS, default="array")
+    parser.add_argument("--reembed-existing", action="store_true",
+                        help="Also re-embed documents whose vector has no content hash yet")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be embedded")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    logger.info("Retrieving MongoDB connection string from Secrets Manager")
+    client = MongoClient(get_secret("workshop/atlas_secret"))  # Replace with your secret name
+
+    if args.embedder == "stub":
+        embedder = StubEmbedder(args.dimensions)
+        model_id = embedder.model_id
+    else:
+        import boto3
+
+        embedder = TitanEmbedder(boto3.client('bedrock-runtime', region_name=args.region), args.model_id)
+        model_id = args.model_id
+
+    backfill = EmbeddingBackfill(
+        client[args.db][args.collection], embedder, model_id,
+        source_field=args.source_field, vector_field=args.field, vector_encoding=args.vector_encoding,
+        workers=args.workers, batch_size=args.batch_size, write_batch=args.write_batch,
+        reembed_existing=args.reembed_existing, backoff=AdaptiveBackoff(),
+    )
+    stats = backfill.run(dry_run=args.dry_run)
+    logger.info(f"Scanned {stats['scanned']} documents in {stats['seconds']}s ({stats['docs_per_sec']} docs/sec): "
+                f"{stats['embedded']} texts embedded, {stats['deduplicated']} duplicates reused, "
+                f"{stats['adopted']} existing vectors hashed, {stats['unchanged']} unchanged, "
+                f"{stats['written']} documents updated, {stats['throttled']} throttled calls")
+
+
+if __name__ == "__main__":
+    main()
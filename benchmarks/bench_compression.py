@@ -0,0 +1,216 @@
+"""
+Wire compression of $vectorSearch requests and replies, per compressor.
+
+Offline, encodes the aggregate command of a vector search (with the query
+vector as an array of doubles or a packed float32 binary) and its reply
+(the travel results, or whole places with their embeddings) as the driver
+would send them, and reports their size on the wire and the compression
+time with every compressor installed. With --uri, also runs the search
+against a deployment through clients offering a single compressor and
+reports latency and, when serverStatus is allowed, the bytes the server
+sent and received.
+
+    python benchmarks/bench_compression.py --dim 1536 --results 10
+    python benchmarks/bench_compression.py --uri "$ATLAS_URI" --queries 50
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+import zlib
+
+import bson
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_handlers import COUNTRIES, FEATURES, SEASONS, stub_embedding
+from vector_codec import encode_vector
+
+# OP_MSG header, flag bits and section kind; OP_COMPRESSED adds the original
+# opcode, the uncompressed size and the compressor id to the message header
+OP_MSG_OVERHEAD = 16 + 4 + 1
+OP_COMPRESSED_OVERHEAD = 16 + 4 + 4 + 1
+
+
+def compressors():
+    """
+    (compress, decompress) of every compressor pymongo can use that is installed here
+    """
+    codecs = {"zlib": (lambda data: zlib.compress(data, -1), zlib.decompress)}
+    try:
+        if sys.version_info >= (3, 14):
+            from compression import zstd
+        else:
+            from backports import zstd
+        codecs["zstd"] = (zstd.compress, zstd.decompress)
+    except ImportError:
+        try:
+            import zstandard
+
+            codecs["zstd"] = (zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+        except ImportError:
+            pass
+    try:
+        import snappy
+
+        codecs["snappy"] = (snappy.compress, snappy.uncompress)
+    except ImportError:
+        pass
+    return codecs
+
+
+def embedding(text, args, rng):
+    """
+    Stub embedding, float32 values unless --full-precision fills the rest of the double's mantissa
+    """
+    vector = stub_embedding(text, args.dim)
+    if args.full_precision:
+        vector = [value + rng.uniform(-1e-8, 1e-8) for value in vector]
+    return vector
+
+
+def place(rng, args, encoding):
+    country = rng.choice(COUNTRIES)
+    about = f"{country} destination known for {', '.join(rng.sample(FEATURES, 3))}. " * 3
+    return {
+        "_id": bson.ObjectId(), "Place Name": f"Place {rng.randrange(10000)}", "Country": country,
+        "Best Time To Visit": rng.choice(SEASONS), "About Place": about,
+        "details_embedding": encode_vector(embedding(about, args, rng), encoding),
+    }
+
+
+def payloads(args):
+    """
+    BSON bodies of the messages compared, by name
+    """
+    rng = random.Random(args.seed)
+    query = embedding("quiet beaches", args, rng)
+
+    def request(encoding):
+        return bson.encode({
+            "aggregate": "asia",
+            "pipeline": [
+                {"$vectorSearch": {"index": "travel_vector_index", "path": "details_embedding",
+                                   "queryVector": encode_vector(query, encoding), "numCandidates": 200,
+                                   "limit": args.results}},
+                {"$project": {"score": {"$meta": "vectorSearchScore"}, "About Place": 1, "_id": 0}},
+            ],
+            "cursor": {},
+            "$db": "travel",
+        })
+
+    def reply(docs):
+        return bson.encode({"cursor": {"firstBatch": docs, "id": 0, "ns": "travel.asia"}, "ok": 1.0})
+
+    places = [place(rng, args, "array") for _ in range(args.results)]
+    results = [{"About Place": doc["About Place"], "score": rng.random()} for doc in places]
+    return {
+        "request, array vector": request("array"),
+        "request, float32 vector": request("float32"),
+        "reply, travel results": reply(results),
+        "reply, places + array vectors": reply(places),
+        "reply, places + float32 vectors": reply([place(rng, args, "float32") for _ in range(args.results)]),
+    }
+
+
+def offline(args):
+    codecs = compressors()
+    print(f"{args.dim}-dim {'float64' if args.full_precision else 'float32'} vectors, {args.results} results, "
+          f"compressors: {', '.join(codecs)}")
+    print(f"{'message':<34}{'compressor':<12}{'wire bytes':>12}{'ratio':>8}{'compress us':>13}{'decompress us':>15}")
+    for name, body in payloads(args).items():
+        print(f"{name:<34}{'none':<12}{OP_MSG_OVERHEAD + len(body):>12,}{1.0:>8.2f}")
+        section = b"\x00\x00\x00\x00\x00" + body
+        for codec, (compress, decompress) in codecs.items():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                compressed = compress(section)
+            compress_us = (time.perf_counter() - start) / args.repeat * 1e6
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                decompress(compressed)
+            decompress_us = (time.perf_counter() - start) / args.repeat * 1e6
+            wire = OP_COMPRESSED_OVERHEAD + len(compressed)
+            print(f"{'':<34}{codec:<12}{wire:>12,}{(OP_MSG_OVERHEAD + len(body)) / wire:>8.2f}"
+                  f"{compress_us:>13.1f}{decompress_us:>15.1f}")
+
+
+def network_counters(client):
+    try:
+        network = client.admin.command("serverStatus")["network"]
+    except Exception:
+        return None
+    return network.get("physicalBytesIn", network["bytesIn"]), network.get("physicalBytesOut", network["bytesOut"])
+
+
+def live(args):
+    from pymongo import MongoClient
+
+    from atlas_client import client_options
+
+    rng = random.Random(args.seed)
+    queries = [embedding(f"query {rng.random()}", args, rng) for _ in range(args.queries)]
+    projection = {"score": {"$meta": "vectorSearchScore"}, "About Place": 1, "_id": 0}
+    if args.include_vectors:
+        projection[args.field] = 1
+    print(f"\n{args.db}.{args.collection}, {args.queries} queries, limit {args.results}")
+    print(f"{'compressor':<12}{'p50 ms':>9}{'p95 ms':>9}{'server in/query':>17}{'server out/query':>18}")
+    for codec in ["none", *compressors()]:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            client = MongoClient(args.uri, **client_options(compressors=[] if codec == "none" else [codec]))
+        if any(str(warning.message).startswith("Wire protocol compression") for warning in caught):
+            print(f"{codec:<12}not available to pymongo, install pymongo[{codec}]")
+            client.close()
+            continue
+        collection = client[args.db][args.collection]
+        pipeline = lambda vector: [
+            {"$vectorSearch": {"index": args.index, "path": args.field, "queryVector": encode_vector(vector),
+                               "numCandidates": args.results * 20, "limit": args.results}},
+            {"$project": projection},
+        ]
+        list(collection.aggregate(pipeline(queries[0])))
+        before = network_counters(client)
+        latencies = []
+        for vector in queries:
+            start = time.perf_counter()
+            list(collection.aggregate(pipeline(vector)))
+            latencies.append((time.perf_counter() - start) * 1000)
+        after = network_counters(client)
+        latencies.sort()
+        line = f"{codec:<12}{statistics.median(latencies):>9.2f}{latencies[int(0.95 * (len(latencies) - 1))]:>9.2f}"
+        if before and after:
+            line += f"{(after[0] - before[0]) / len(queries):>17,.0f}{(after[1] - before[1]) / len(queries):>18,.0f}"
+        print(line)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--full-precision", action="store_true",
+                        help="Vectors with full double precision instead of float32 values stored as doubles")
+    parser.add_argument("--results", type=int, default=10, help="Documents per reply / $vectorSearch limit")
+    parser.add_argument("--repeat", type=int, default=200, help="Compressions timed per message")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--uri", help="Also measure live searches against this deployment")
+    parser.add_argument("--db", default="travel")
+    parser.add_argument("--collection", default="asia")
+    parser.add_argument("--index", default="travel_vector_index")
+    parser.add_argument("--field", default="details_embedding")
+    parser.add_argument("--queries", type=int, default=50, help="Live searches per compressor")
+    parser.add_argument("--include-vectors", action="store_true", help="Return the embeddings in the live searches")
+    args = parser.parse_args()
+
+    offline(args)
+    if args.uri:
+        live(args)
+
+
+if __name__ == "__main__":
+    main()
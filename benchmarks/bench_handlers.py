@@ -0,0 +1,424 @@
+"""
+Offline latency benchmark for the agent handlers and the travel Lambda.
+
+Every scenario replays generated Bedrock agent events against one handler in
+its own Python process, with Secrets Manager and Bedrock stubbed and MongoDB
+replaced by the in-memory stand-in in fake_mongo.py (or a local MongoDB /
+Atlas local deployment with --backend mongodb). Reports p50/p95/p99 latency,
+throughput, peak RSS and allocations per scenario and writes them as JSON;
+--baseline compares with a previous run and fails on p95 regressions.
+
+    python benchmarks/bench_handlers.py --iterations 200 --output bench.json
+    python benchmarks/bench_handlers.py --baseline bench.json --threshold 10
+"""
+import argparse
+import hashlib
+import importlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ("shared", "benchmarks", "agents", "hello_world"):
+    sys.path.insert(0, os.path.join(ROOT, path))
+
+from lookup_fields import MONTHS, add_lookup_fields
+
+COUNTRIES = ["Japan", "Vietnam", "Thailand", "India", "Indonesia", "Nepal", "Sri Lanka", "Cambodia"]
+FEATURES = ["beach", "temples", "street food", "mountain hiking", "night markets", "old town", "islands",
+            "waterfalls", "tea plantations", "hot springs", "jungle trekking", "diving", "festivals"]
+QUERIES = ["beach", "temples in Japan", "quiet mountain villages", "street food markets", "islands for diving",
+           "hot springs in winter", "old towns with night markets", "waterfalls and jungle trekking"]
+MOVIE_QUERIES = ["space adventure", "heist gone wrong", "romantic comedy in Paris", "war drama", "haunted house"]
+SEASONS = ["November to March", "October to April", "March to May", "June to September", "Year-round"]
+CUISINES = ["Italian", "Chinese", "Mexican", "Bakery", "Pizza", "Thai", "Indian", "American"]
+BOROUGHS = ["Manhattan", "Brooklyn", "Queens", "Bronx", "Staten Island"]
+
+LAMBDA_CONTEXT = SimpleNamespace(
+    function_name="bench", function_version="$LATEST", memory_limit_in_mb=128,
+    invoked_function_arn="arn:aws:lambda:us-east-1:000000000000:function:bench",
+    aws_request_id="bench", log_group_name="/aws/lambda/bench", log_stream_name="bench",
+    get_remaining_time_in_millis=lambda: 50000,
+)
+
+
+def stub_embedding(text, dim):
+    """Deterministic pseudo-embedding, identical texts get identical vectors."""
+    import numpy as np
+
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32).tolist()
+
+
+class StubBedrockRuntime:
+    def __init__(self, dim, latency_ms):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def invoke_model(self, modelId, body, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        text = json.loads(body)["inputText"]
+        payload = json.dumps({"embedding": stub_embedding(text, self.dim)}).encode("utf-8")
+        return {"body": io.BytesIO(payload)}
+
+
+class StubEmbeddings:
+    """Stands in for langchain's BedrockEmbeddings in the travel Lambda."""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def embed_documents(self, texts):
+        time.sleep(self.runtime.latency_ms / 1000)
+        return [stub_embedding(text, self.runtime.dim) for text in texts]
+
+
+class StubSecretsManager:
+    def __init__(self, uri):
+        self.uri = uri
+
+    def get_secret_value(self, SecretId):
+        return {"SecretString": self.uri}
+
+
+def seed(client, size, dim, rng):
+    places = []
+    for i in range(size):
+        country = rng.choice(COUNTRIES)
+        about = f"{country} destination known for {', '.join(rng.sample(FEATURES, 3))}. " * 3
+        places.append(add_lookup_fields({
+            "Place Name": f"Place {i}", "Country": country, "Best Time To Visit": rng.choice(SEASONS),
+            "About Place": about, "details_embedding": stub_embedding(about, dim),
+        }))
+    client["travel"]["asia"].insert_many(places)
+
+    movies = [{"title": f"Movie {i} {rng.choice(MOVIE_QUERIES)}", "plot": rng.choice(MOVIE_QUERIES),
+               "plot_embedding": stub_embedding(f"movie {i}", dim)} for i in range(size)]
+    client["sample_mflix"]["embedded_movies"].insert_many(movies)
+
+    restaurants = [{"name": f"{rng.choice(CUISINES)} Place {i}", "cuisine": rng.choice(CUISINES),
+                    "borough": rng.choice(BOROUGHS),
+                    "address": {"building": str(i), "street": "Main Street", "zipcode": "10001"}}
+                   for i in range(size)]
+    client["sample_restaurants"]["restaurants"].insert_many(restaurants)
+
+    records = [{"name": f"record {i}", "category": rng.choice(CUISINES), "n": i} for i in range(size)]
+    client["bench"]["records"].insert_many(records)
+
+
+def seed_deployment(args):
+    """
+    Replace the benchmark collections of the deployment at --uri with the
+    seeded data and create the search indexes the scenarios query, waiting
+    until they are queryable
+    """
+    from pymongo import MongoClient
+    from pymongo.errors import OperationFailure
+    from pymongo.operations import SearchIndexModel
+
+    from vector_filters import ensure_vector_index
+
+    client = MongoClient(args.uri)
+    for db_name, collection_name in [("travel", "asia"), ("sample_mflix", "embedded_movies"),
+                                     ("sample_restaurants", "restaurants"), ("bench", "records")]:
+        client[db_name].drop_collection(collection_name)
+    seed(client, args.docs, args.dim, random.Random(args.seed))
+
+    places, movies = client["travel"]["asia"], client["sample_mflix"]["embedded_movies"]
+    restaurants = client["sample_restaurants"]["restaurants"]
+    dynamic = {"mappings": {"dynamic": True}}
+    try:
+        ensure_vector_index(places, "travel_vector_index", "details_embedding", args.dim)
+        movies.create_search_index(SearchIndexModel(
+            definition={"fields": [{"type": "vector", "path": "plot_embedding", "numDimensions": args.dim,
+                                    "similarity": "cosine"}]},
+            name="vector_index", type="vectorSearch"))
+        movies.create_search_index(SearchIndexModel(definition=dynamic, name="default"))
+        restaurants.create_search_index(SearchIndexModel(definition=dynamic, name="default"))
+    except OperationFailure as e:
+        print(f"Seeded {args.docs} documents per collection, but could not create the search indexes ({e}); "
+              f"the search scenarios need a deployment with Atlas Search, e.g. mongodb/mongodb-atlas-local")
+        client.close()
+        return
+
+    deadline = time.monotonic() + 300
+    for collection in (places, movies, restaurants):
+        while not all(index.get("queryable") for index in collection.list_search_indexes()):
+            if time.monotonic() > deadline:
+                sys.exit(f"Search indexes of {collection.full_name} not queryable after 5 minutes")
+            time.sleep(1)
+    print(f"Seeded {args.docs} documents per collection and built the search indexes")
+    client.close()
+
+
+def agent_event(function, **parameters):
+    return {
+        "messageVersion": "1.0",
+        "agent": {"name": "bench", "id": "bench", "alias": "bench", "version": "1"},
+        "actionGroup": "bench",
+        "function": function,
+        "sessionId": "bench",
+        "inputText": "",
+        "sessionAttributes": {},
+        "promptSessionAttributes": {},
+        "parameters": [
+            {"name": name, "type": "number" if isinstance(value, int) else "string", "value": str(value)}
+            for name, value in parameters.items()
+        ],
+    }
+
+
+def travel_event(api_path, **parameters):
+    event = agent_event(None, **parameters)
+    del event["function"]
+    event.update(apiPath=api_path, httpMethod="GET")
+    return event
+
+
+def crud_event(function, obj):
+    return agent_event(function, json_obj=json.dumps(obj))
+
+
+AGENT_ENV = {
+    "crud": {"DB_NAME": "bench", "COLLECTION": "records"},
+    "vector_search": {"DB_NAME": "sample_mflix", "COLLECTION": "embedded_movies", "SEARCH_INDEX": "vector_index",
+                      "VECTOR_FIELD": "plot_embedding"},
+    "hybrid_search": {"DB_NAME": "sample_mflix", "COLLECTION": "embedded_movies", "SEARCH_INDEX": "default",
+                      "VECTOR_INDEX": "vector_index", "VECTOR_FIELD": "plot_embedding", "HYBRID_MODE": "client"},
+    "full_text_search": {"DB_NAME": "sample_restaurants", "COLLECTION": "restaurants", "SEARCH_INDEX": "default"},
+    "app": {},
+}
+
+# The few distinct queries replayed would otherwise mostly hit the embedding and
+# semantic caches, so scenarios run without them; the ".cached" variants keep
+# the caches at their defaults to measure the hit path
+UNCACHED_ENV = {"EMBEDDING_CACHE_SIZE": "0", "SEMANTIC_CACHE_SIZE": "0"}
+CACHED_SCENARIOS = {"vector_search.cached", "travel.get_place_semantically.cached"}
+
+# scenario -> (handler module, event factory taking (rng, iteration))
+SCENARIOS = {
+    "crud.insert_one": ("crud", lambda rng, i: crud_event("insert_one", {"name": f"new {i}", "n": i})),
+    "crud.find_one": ("crud", lambda rng, i: crud_event("find_one", {"n": rng.randrange(100)})),
+    "crud.find_many": ("crud", lambda rng, i: crud_event("find_many", {"filter": {"category": rng.choice(CUISINES)}})),
+    "crud.update_one": ("crud", lambda rng, i: crud_event(
+        "update_one", {"filter": {"n": rng.randrange(100)}, "update": {"$set": {"seen": i}}})),
+    "crud.bulk_write": ("crud", lambda rng, i: crud_event("bulk_write", [
+        {"insert_one": {"document": {"name": f"bulk {i}", "n": -i}}},
+        {"update_one": {"filter": {"n": rng.randrange(100)}, "update": {"$inc": {"hits": 1}}}},
+        {"delete_one": {"filter": {"n": -i}}},
+    ])),
+    "vector_search": ("vector_search", lambda rng, i: agent_event(
+        "vector_search", query=rng.choice(MOVIE_QUERIES), limiter=5)),
+    "hybrid_search": ("hybrid_search", lambda rng, i: agent_event(
+        "hybrid_search", query=rng.choice(MOVIE_QUERIES), limiter=5)),
+    "full_text_search": ("full_text_search", lambda rng, i: agent_event(
+        "search_restaurants", keyword=rng.choice(CUISINES), limiter=5)),
+    "travel.current_time": ("app", lambda rng, i: travel_event("/current_time")),
+    "travel.get_place_by_country": ("app", lambda rng, i: travel_event(
+        "/get_place_by_country", query_str=rng.choice(COUNTRIES))),
+    "travel.get_place_by_name": ("app", lambda rng, i: travel_event(
+        "/get_place_by_name", query_str=f"Place {rng.randrange(100)}")),
+    "travel.get_place_best_time": ("app", lambda rng, i: travel_event(
+        "/get_place_best_time", query_str=f"Place {rng.randrange(100)}")),
+    "travel.get_place_semantically": ("app", lambda rng, i: travel_event(
+        "/get_place_semantically", query=rng.choice(QUERIES))),
+    "travel.get_place_semantically_filtered": ("app", lambda rng, i: travel_event(
+        "/get_place_semantically", query=rng.choice(QUERIES), country=rng.choice(COUNTRIES),
+        month=rng.choice(MONTHS))),
+}
+SCENARIOS["vector_search.cached"] = SCENARIOS["vector_search"]
+SCENARIOS["travel.get_place_semantically.cached"] = SCENARIOS["travel.get_place_semantically"]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_scenario(name, args):
+    """Run one scenario in the current process and return its metrics."""
+    module_name, make_event = SCENARIOS[name]
+    rng = random.Random(args.seed)
+    runtime = StubBedrockRuntime(args.dim, args.bedrock_latency_ms)
+    uri = args.uri if args.backend == "mongodb" else "mongodb://fake"
+
+    def fake_boto3_client(service_name=None, *a, **kwargs):
+        return StubSecretsManager(uri) if service_name == "secretsmanager" else runtime
+
+    os.environ.update({"ATLAS_CONN_STR": uri, "POWERTOOLS_TRACE_DISABLED": "true", **AGENT_ENV[module_name]})
+    if name not in CACHED_SCENARIOS:
+        os.environ.update(UNCACHED_ENV)
+    patches = [mock.patch("boto3.client", fake_boto3_client)]
+    if args.backend == "memory":
+        from fake_mongo import FakeMongoClient
+
+        client = FakeMongoClient()
+        seed(client, args.docs, args.dim, random.Random(args.seed))
+        patches.append(mock.patch("pymongo.MongoClient", lambda *a, **kwargs: client))
+    for patch in patches:
+        patch.start()
+
+    module = importlib.import_module(module_name)
+    if module_name == "app":
+        module.get_embeddings = lambda model_id: StubEmbeddings(runtime)
+
+    def invoke(i):
+        return module.lambda_handler(make_event(rng, i), LAMBDA_CONTEXT)
+
+    for i in range(args.warmup):
+        invoke(i)
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(args.iterations):
+        start = time.perf_counter()
+        invoke(args.warmup + i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    peaks, retained = [], []
+    for i in range(args.alloc_iterations):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        invoke(args.warmup + args.iterations + i)
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append((peak - before) / 1024)
+        retained.append((current - before) / 1024)
+    tracemalloc.stop()
+
+    for patch in patches:
+        patch.stop()
+
+    return {
+        "iterations": args.iterations,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "throughput_rps": round(args.iterations / elapsed, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "alloc_peak_kb": round(statistics.mean(peaks), 1) if peaks else None,
+        "alloc_retained_kb": round(statistics.mean(retained), 1) if retained else None,
+    }
+
+
+def run_child(name, args):
+    """Run a scenario in a fresh interpreter, so RSS and imports are per scenario."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    command = [sys.executable, os.path.abspath(__file__), "--child", name, "--child-output", output,
+               "--backend", args.backend, "--uri", args.uri, "--docs", str(args.docs), "--dim", str(args.dim),
+               "--iterations", str(args.iterations), "--warmup", str(args.warmup),
+               "--alloc-iterations", str(args.alloc_iterations), "--seed", str(args.seed),
+               "--bedrock-latency-ms", str(args.bedrock_latency_ms)]
+    try:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"\n{'scenario':<40}{'p95 base':>10}{'p95 now':>10}{'change':>9}")
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["p95_ms"], metrics["p95_ms"]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:<40}{before:>10.2f}{after:>10.2f}{change:>8.1f}%{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", action="append", dest="scenarios", choices=sorted(SCENARIOS),
+                        help="Scenario to run, repeat for several (default: all)")
+    parser.add_argument("--backend", choices=["memory", "mongodb"], default="memory",
+                        help="In-memory stand-in, or a MongoDB deployment at --uri holding the same data "
+                             "(see --seed-data)")
+    parser.add_argument("--seed-data", action="store_true",
+                        help="With --backend mongodb, first replace the benchmark collections at --uri with "
+                             "the seeded data and build their search indexes")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/?directConnection=true")
+    parser.add_argument("--docs", type=int, default=1000, help="Documents seeded per collection")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimensions of the stubbed model")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--alloc-iterations", type=int, default=20,
+                        help="Extra invocations traced with tracemalloc to measure allocations")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=0.0,
+                        help="Latency added to every stubbed Bedrock call")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Previous results to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0, help="p95 regression threshold in percent")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.child:
+        metrics = run_scenario(args.child, args)
+        with open(args.child_output, "w") as f:
+            json.dump(metrics, f)
+        return
+
+    if args.seed_data and args.backend == "mongodb":
+        seed_deployment(args)
+
+    results = {}
+    print(f"{'scenario':<40}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'RSS MB':>9}{'alloc KB':>10}")
+    for name in args.scenarios or SCENARIOS:
+        metrics = results[name] = run_child(name, args)
+        print(f"{name:<40}{metrics['p50_ms']:>9.2f}{metrics['p95_ms']:>9.2f}{metrics['p99_ms']:>9.2f}"
+              f"{metrics['throughput_rps']:>9.0f}{metrics['peak_rss_mb']:>9.0f}{metrics['alloc_peak_kb'] or 0:>10.0f}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(), "git_revision": git_revision(),
+            "python": platform.python_version(), "backend": args.backend, "docs": args.docs, "dim": args.dim,
+            "iterations": args.iterations, "bedrock_latency_ms": args.bedrock_latency_ms,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline and compare_with_baseline(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
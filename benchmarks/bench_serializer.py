@@ -0,0 +1,61 @@
+"""
+Compare the shared JSON serializer with the str.format/repr formatting the
+handlers used before, on documents shaped like the agents' results.
+
+    python benchmarks/bench_serializer.py --docs 100 --repeat 200
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import timeit
+
+from bson import Decimal128, ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared'))
+from serializer import dumps
+
+
+def sample_docs(count, with_embedding):
+    docs = []
+    for i in range(count):
+        doc = {
+            "_id": ObjectId(),
+            "Place Name": f"Place {i}",
+            "Country": random.choice(["Japan", "Vietnam", "Thailand", "India"]),
+            "Best Time To Visit": "November to March",
+            "About Place": "A quiet town with old temples, night markets and beaches. " * 4,
+            "rating": Decimal128(str(round(random.uniform(1, 5), 2))),
+            "updated_at": datetime.datetime.now(datetime.timezone.utc),
+            "score": random.random(),
+        }
+        if with_embedding:
+            doc["details_embedding"] = [random.uniform(-1, 1) for _ in range(1536)]
+        docs.append(doc)
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100, help="Documents per result list")
+    parser.add_argument("--repeat", type=int, default=200, help="Serializations timed per formatter")
+    parser.add_argument("--embedding", action="store_true", help="Include a 1536-dim embedding in every document")
+    args = parser.parse_args()
+
+    docs = sample_docs(args.docs, args.embedding)
+    formatters = {
+        "format/repr": lambda: "Record found: {}".format(docs),
+        "serializer": lambda: "Record found: {}".format(dumps(docs)),
+        "serializer+fields": lambda: "Record found: {}".format(dumps(docs, fields=["Place Name", "Country", "score"])),
+    }
+
+    print(f"{args.docs} documents, {args.repeat} runs{', with embeddings' if args.embedding else ''}")
+    print(f"{'formatter':<20}{'ms/call':>10}{'chars':>12}")
+    for name, formatter in formatters.items():
+        seconds = timeit.timeit(formatter, number=args.repeat)
+        print(f"{name:<20}{seconds / args.repeat * 1000:>10.3f}{len(formatter()):>12,}")
+
+
+if __name__ == "__main__":
+    main()
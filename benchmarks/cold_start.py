@@ -0,0 +1,75 @@
+"""
+Measure the import (cold start) cost of a Lambda handler module.
+
+Imports the module in fresh interpreters with `python -X importtime`, then
+reports the wall time of the import and the import time spent in each
+top-level package (the self time of all its modules), as the median over
+--runs runs.
+
+    python benchmarks/cold_start.py --module app --path hello_world --path shared
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_once(module, paths):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(paths))
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, cwd=paths[0], capture_output=True, text=True, check=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    # Sum the self time of every imported module into its top-level package
+    packages = defaultdict(float)
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us) / 1000
+    return wall_ms, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="app", help="Handler module to import")
+    parser.add_argument("--path", action="append", dest="paths",
+                        help="Directories put on PYTHONPATH, the first one is the working directory "
+                             "(default: hello_world and shared)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Number of packages listed")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    paths = [os.path.abspath(p) for p in (args.paths or [os.path.join(ROOT, "hello_world"), os.path.join(ROOT, "shared")])]
+
+    walls, per_package = [], defaultdict(list)
+    for _ in range(args.runs):
+        wall_ms, packages = import_once(args.module, paths)
+        walls.append(wall_ms)
+        for name, ms in packages.items():
+            per_package[name].append(ms)
+
+    medians = {name: statistics.median(values) for name, values in per_package.items()}
+    heaviest = sorted(medians.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    print(f"import {args.module}: {statistics.median(walls):.0f} ms wall (median of {args.runs} runs)")
+    print(f"{'package':<50}{'import ms':>15}")
+    for name, ms in heaviest:
+        print(f"{name:<50}{ms:>15.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"module": args.module, "wall_ms": statistics.median(walls), "packages": medians}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
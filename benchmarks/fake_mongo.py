@@ -0,0 +1,393 @@
+"""
+In-memory stand-in for the subset of pymongo used by the handlers, so they
+can be benchmarked without Atlas. `$vectorSearch` is an exact cosine scan
+and `$search` scores documents by the number of query terms they contain;
+the goal is realistic call patterns and result sizes, not Atlas semantics.
+"""
+import copy
+import random
+import re
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+from vector_codec import decode_vector
+
+MISSING = object()
+
+
+def get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return MISSING
+    return value
+
+
+def set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def unset_path(doc, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part, {})
+    doc.pop(parts[-1], None)
+
+
+def compare(value, op, expected):
+    if op == "$eq":
+        return value == expected or (isinstance(value, list) and expected in value)
+    if op == "$ne":
+        return not compare(value, "$eq", expected)
+    if op == "$in":
+        return any(compare(value, "$eq", e) for e in expected)
+    if op == "$nin":
+        return not compare(value, "$in", expected)
+    if op == "$exists":
+        return (value is not MISSING) == bool(expected)
+    if op == "$type":
+        kinds = {"array": list, "binData": bytes, "string": str, "object": dict}
+        return value is not MISSING and isinstance(value, kinds[expected])
+    if op == "$regex":
+        return isinstance(value, str) and re.search(expected, value) is not None
+    if value is MISSING or value is None:
+        return False
+    if op == "$gt":
+        return value > expected
+    if op == "$gte":
+        return value >= expected
+    if op == "$lt":
+        return value < expected
+    if op == "$lte":
+        return value <= expected
+    raise NotImplementedError(f"Query operator {op} is not supported by the fake")
+
+
+def matches(doc, filter):
+    for key, condition in (filter or {}).items():
+        if key == "$and":
+            if not all(matches(doc, f) for f in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, f) for f in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, f) for f in condition):
+                return False
+        else:
+            value = get_path(doc, key)
+            if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+                options = condition.get("$options", "")
+                for op, expected in condition.items():
+                    if op == "$options":
+                        continue
+                    if op == "$regex" and "i" in options:
+                        expected = "(?i)" + expected
+                    if not compare(value, op, expected):
+                        return False
+            elif not compare(value, "$eq", condition):
+                return False
+    return True
+
+
+def evaluate(doc, expression, meta):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(doc, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, dict):
+        if "$meta" in expression:
+            return meta.get(expression["$meta"])
+        if "$concat" in expression:
+            parts = [evaluate(doc, part, meta) for part in expression["$concat"]]
+            return None if any(p is None for p in parts) else "".join(str(p) for p in parts)
+        if "$ifNull" in expression:
+            value, default = expression["$ifNull"]
+            value = evaluate(doc, value, meta)
+            return evaluate(doc, default, meta) if value is None else value
+        return {k: evaluate(doc, v, meta) for k, v in expression.items()}
+    return expression
+
+
+def project(doc, projection, meta=None):
+    meta = meta or {}
+    if not projection:
+        return copy.deepcopy(doc)
+    include_id = projection.get("_id", 1) not in (0, False)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    inclusion = any(not (v in (0, False)) for v in fields.values())
+    if inclusion:
+        result = {}
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for key, spec in fields.items():
+            if spec in (1, True):
+                value = get_path(doc, key)
+                if value is not MISSING:
+                    set_path(result, key, copy.deepcopy(value))
+            else:
+                set_path(result, key, evaluate(doc, spec, meta))
+        if projection.get("_id") not in (None, 0, 1, False, True):
+            result["_id"] = evaluate(doc, projection["_id"], meta)
+        return result
+    result = copy.deepcopy(doc)
+    for key in fields:
+        unset_path(result, key)
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def sort_docs(docs, sort):
+    for key, direction in reversed(list(sort)):
+        docs.sort(key=lambda d: (get_path(d, key) is MISSING, get_path(d, key) if get_path(d, key) is not MISSING else 0),
+                  reverse=direction == -1)
+    return docs
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = iter(docs)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._docs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._docs = iter(())
+
+    def batch_size(self, size):
+        return self
+
+    def max_time_ms(self, ms):
+        return self
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+        self.docs = []
+
+    # Reads
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0, batch_size=0, **kwargs):
+        docs = [d for d in self.docs if matches(d, filter)]
+        if sort:
+            docs = sort_docs(docs, sort)
+        docs = docs[skip:]
+        if limit:
+            docs = docs[:limit]
+        return FakeCursor([project(d, projection) for d in docs])
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        return next(iter(self.find(filter, projection, sort=sort, limit=1)), None)
+
+    def count_documents(self, filter, **kwargs):
+        return sum(1 for d in self.docs if matches(d, filter))
+
+    def estimated_document_count(self, **kwargs):
+        return len(self.docs)
+
+    # Writes
+    def insert_one(self, document, **kwargs):
+        document.setdefault("_id", ObjectId())
+        self.docs.append(copy.deepcopy(document))
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents, **kwargs):
+        return InsertManyResult([self.insert_one(d).inserted_id for d in documents], True)
+
+    def _apply_update(self, doc, update):
+        before = copy.deepcopy(doc)
+        if not any(k.startswith("$") for k in update):
+            _id = doc["_id"]
+            doc.clear()
+            doc.update(copy.deepcopy(update))
+            doc["_id"] = _id
+        for op, fields in update.items():
+            if op == "$set":
+                for key, value in fields.items():
+                    set_path(doc, key, copy.deepcopy(value))
+            elif op == "$unset":
+                for key in fields:
+                    unset_path(doc, key)
+            elif op == "$inc":
+                for key, value in fields.items():
+                    current = get_path(doc, key)
+                    set_path(doc, key, (0 if current is MISSING else current) + value)
+            elif op.startswith("$"):
+                raise NotImplementedError(f"Update operator {op} is not supported by the fake")
+        return doc != before
+
+    def _update(self, filter, update, upsert, many):
+        matched = [d for d in self.docs if matches(d, filter)]
+        if not many:
+            matched = matched[:1]
+        modified = sum(self._apply_update(d, update) for d in matched)
+        raw = {"n": len(matched), "nModified": modified}
+        if not matched and upsert:
+            doc = {k: v for k, v in (filter or {}).items() if not k.startswith("$") and not isinstance(v, dict)}
+            doc["_id"] = doc.get("_id", ObjectId())
+            self._apply_update(doc, update)
+            self.docs.append(doc)
+            raw.update(n=1, upserted=doc["_id"])
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        return self._update(filter, update, upsert, many=False)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        return self._update(filter, update, upsert, many=True)
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        return self._update(filter, replacement, upsert, many=False)
+
+    def delete_one(self, filter, **kwargs):
+        for i, d in enumerate(self.docs):
+            if matches(d, filter):
+                del self.docs[i]
+                return DeleteResult({"n": 1}, True)
+        return DeleteResult({"n": 0}, True)
+
+    def delete_many(self, filter, **kwargs):
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not matches(d, filter)]
+        return DeleteResult({"n": before - len(self.docs)}, True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0,
+                  "upserted": [], "writeErrors": [], "writeConcernErrors": []}
+        for request in requests:
+            if isinstance(request, InsertOne):
+                self.insert_one(request._doc)
+                counts["nInserted"] += 1
+            elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                result = self._update(request._filter, request._doc, request._upsert, many=isinstance(request, UpdateMany))
+                if result.upserted_id is not None:
+                    counts["nUpserted"] += 1
+                    counts["upserted"].append({"index": len(counts["upserted"]), "_id": result.upserted_id})
+                else:
+                    counts["nMatched"] += result.matched_count
+                    counts["nModified"] += result.modified_count
+            elif isinstance(request, DeleteOne):
+                counts["nRemoved"] += self.delete_one(request._filter).deleted_count
+            elif isinstance(request, DeleteMany):
+                counts["nRemoved"] += self.delete_many(request._filter).deleted_count
+        return BulkWriteResult(counts, True)
+
+    # Indexes
+    def create_index(self, keys, **kwargs):
+        return kwargs.get("name") or (keys if isinstance(keys, str) else "_".join(f"{k}_{d}" for k, d in keys))
+
+    def create_search_index(self, model, **kwargs):
+        return "search_index"
+
+    def list_search_indexes(self, name=None, **kwargs):
+        return FakeCursor([])
+
+    # Aggregation
+    def _vector_search(self, spec):
+        import numpy as np
+
+        candidates = [d for d in self.docs if get_path(d, spec["path"]) is not MISSING and matches(d, spec.get("filter"))]
+        if not candidates:
+            return []
+        query = decode_vector(spec["queryVector"]).astype(np.float32)
+        matrix = np.stack([decode_vector(get_path(d, spec["path"])) for d in candidates]).astype(np.float32)
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+        order = np.argsort(-scores)[:spec["limit"]]
+        return [(candidates[i], {"vectorSearchScore": float((1 + scores[i]) / 2)}) for i in order]
+
+    def _search(self, spec):
+        operator = spec.get("text") or spec.get("phrase")
+        terms = str(operator["query"]).lower().split()
+        path = operator["path"]
+        results = []
+        for d in self.docs:
+            if path == {"wildcard": "*"} or (isinstance(path, dict) and "wildcard" in path):
+                text = " ".join(str(v) for v in d.values() if isinstance(v, (str, dict)))
+            else:
+                paths = path if isinstance(path, list) else [path]
+                text = " ".join(str(get_path(d, p)) for p in paths if get_path(d, p) is not MISSING)
+            text = text.lower()
+            score = sum(text.count(term) for term in terms)
+            if score:
+                results.append((d, {"searchScore": float(score)}))
+        results.sort(key=lambda item: item[1]["searchScore"], reverse=True)
+        for position, (d, meta) in enumerate(results):
+            meta["searchSequenceToken"] = f"{position:08d}"
+        after = spec.get("searchAfter")
+        if after is not None:
+            results = [item for item in results if item[1]["searchSequenceToken"] > after]
+        return results
+
+    def aggregate(self, pipeline, **kwargs):
+        items = None
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$vectorSearch":
+                items = self._vector_search(spec)
+                continue
+            if name == "$search":
+                items = self._search(spec)
+                continue
+            if items is None:
+                items = [(d, {}) for d in self.docs]
+            if name == "$match":
+                items = [(d, m) for d, m in items if matches(d, spec)]
+            elif name == "$project":
+                items = [(project(d, spec, m), m) for d, m in items]
+            elif name == "$addFields" or name == "$set":
+                items = [({**d, **{k: evaluate(d, v, m) for k, v in spec.items()}}, m) for d, m in items]
+            elif name == "$limit":
+                items = items[:spec]
+            elif name == "$skip":
+                items = items[spec:]
+            elif name == "$sort":
+                docs = sort_docs([dict(d, __meta=m) for d, m in items], spec.items())
+                items = [({k: v for k, v in d.items() if k != "__meta"}, d["__meta"]) for d in docs]
+            elif name == "$sample":
+                items = random.sample(items, min(spec["size"], len(items)))
+            else:
+                raise NotImplementedError(f"Aggregation stage {name} is not supported by the fake")
+        return FakeCursor([d for d, _ in (items or [])])
+
+
+class FakeDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, FakeCollection(name))
+
+    def command(self, command, *args, **kwargs):
+        return {"ok": 1.0}
+
+
+class FakeMongoClient:
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+        self.admin = FakeDatabase("admin")
+
+    def __getitem__(self, name):
+        return self._databases.setdefault(name, FakeDatabase(name))
+
+    def get_database(self, name, **kwargs):
+        return self[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,38 @@
+import argparse
+import logging
+import os
+import sys
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared'))
+from local_vector_index import build_snapshot
+from atlas_client import get_secret
+
+logger = logging.getLogger('build_vector_snapshot')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write a local vector index snapshot of a collection, see LOCAL_VECTOR_INDEX")
+    parser.add_argument("--db", default="travel")
+    parser.add_argument("--collection", default="asia")
+    parser.add_argument("--field", default="details_embedding", help="Field holding the embeddings")
+    parser.add_argument("--fields", nargs="+", default=["About Place"], help="Fields returned with each result")
+    parser.add_argument("--output", default="vector_snapshot", help="Snapshot directory")
+    parser.add_argument("--ann", action="store_true", help="Also build an HNSW graph (needs hnswlib)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    logger.info("Retrieving MongoDB connection string from Secrets Manager")
+    client = MongoClient(get_secret("workshop/atlas_secret"))  # Replace with your secret name
+    count = build_snapshot(client[args.db][args.collection], args.field, args.fields, args.output, ann=args.ann)
+    logger.info(f"Snapshot of {count} vectors written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,43 @@ from aws_lambda_powertools.event_handler import BedrockAgentResolver
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from typing_extensions import Annotated
 from aws_lambda_powertools.event_handler.openapi.params import Body, Query
-from pymongo import MongoClient
 import os
-from langchain_aws.embeddings import BedrockEmbeddings
-import boto3
-from botocore.exceptions import ClientError
+import json
+from functools import lru_cache
+from typing import Optional
+
+from mongo_client import atlas
+from embeddings import EmbeddingCache
+from semantic_cache import SemanticCache
+from local_vector_index import LocalVectorIndex
+from search_settings import num_candidates
+from vector_filters import vector_filter
+from vector_codec import decode_vector, encode_vector
+from context_packing import CONTEXT_FETCH_K, CONTEXT_RESULTS, mmr, pack_context
+from serializer import dumps
+from stage_timing import timer
+from structured_log import StructuredLog
+from place_lookup import find_places
+from place_catalog import CATALOG_PROJECTION, place_catalog
 
 tracer = Tracer()
 logger = Logger()
+payload_log = StructuredLog(logger=logger)
 app = BedrockAgentResolver()
+embedding_cache = EmbeddingCache.from_env(atlas.get_client)
+result_cache = SemanticCache.from_env()
+vector_index = LocalVectorIndex.from_env("details_embedding", ["About Place"])
+timer.tracer = tracer
+
+
+def format_response(value):
+    """
+    Serialize a route's result, timed as the "format" stage
+    """
+    with timer.stage("format") as stage:
+        body = dumps(value)
+        stage.bytes = len(body)
+    return body
 
 
 @app.get("/current_time", description="Gets the current time in seconds")  
@@ -34,21 +62,11 @@ def current_month() -> str:
 def place_lookup_by_country(query_str: Annotated[str, Query(description="The country name")]
                                     ) -> Annotated[str, Body(description="Place Names")]:
     logger.info(f"Looking up places by country: {query_str}")
-    client = get_mongo_client()
-    # get database and collection
-    collection = get_travel_collection(client)
-    res = ""
-    res = collection.aggregate(
-        [
-            {"$match": {"Country": {"$regex": query_str, "$options": "i"}}},
-            {"$project": {"Place Name": 1}},
-        ]
-    )
-    places = []
-    for place in res:
-        places.append(place["Place Name"])
+
+    res = lookup_places(query_str, ["Country"], ["Place Name"])
+    places = [place["Place Name"] for place in res]
     logger.info(f"Found {len(places)} places in country: {query_str}")
-    return str(places)
+    return format_response(places)
 
 def get_travel_collection(client):
     logger.info("Getting travel collection from MongoDB")
@@ -56,49 +74,49 @@ def get_travel_collection(client):
     collection = db['asia']
     return collection
 
+def lookup_places(query_str, sources, fields=None, limit=0):
+    """
+    Look places up in the in-process catalog when PLACE_CATALOG is enabled,
+    otherwise (or when the catalog has no match) in MongoDB. Only `fields`
+    are returned, all place details when None
+    """
+    if place_catalog is not None:
+        if place_catalog.is_stale():
+            atlas.run(lambda client: place_catalog.refresh(get_travel_collection(client)))
+        places = place_catalog.find(query_str, sources, limit)
+        if places:
+            return [{field: place[field] for field in fields if field in place} if fields else dict(place)
+                    for place in places]
+
+    project = {"_id": 0, **{field: 1 for field in fields}} if fields else CATALOG_PROJECTION
+    return atlas.run(lambda client: find_places(get_travel_collection(client), query_str, sources, project, limit))
+
 @app.get("/get_place_by_name", description="Retrieve place information by place name")
 @tracer.capture_method
 def place_lookup_by_name(query_str: Annotated[str, Query(description="The place name")]
                                  ) -> Annotated[str, Body(description="Place Details")]:
     logger.info(f"Looking up place by name: {query_str}")
-    client = get_mongo_client()
-    collection = get_travel_collection(client)
-    res = ""
-    filter = {
-        "$or": [
-            {"Place Name": {"$regex": query_str, "$options": "i"}},
-            {"Country": {"$regex": query_str, "$options": "i"}},
-        ]
-    }
-    project = {"_id": 0}
-
-    res = collection.find_one(filter=filter, projection=project)
+    places = lookup_places(query_str, ["Place Name", "Country"], None, limit=1)
+    res = places[0] if places else None
     logger.info(f"Found place details for: {query_str}")
-    return str(res)
+    return format_response(res)
 
 @app.get("/get_place_best_time", description="Retrieve place's best time to visit")
 @tracer.capture_method
 def place_best_time_lookup(query_str: Annotated[str, Query(description="The place name")]
                                                ) -> Annotated[str, Body(description="Place's best time to visit")]:
     logger.info(f"Looking up best time to visit for place: {query_str}")
-    client = get_mongo_client()
-    collection = get_travel_collection(client)
-    res = ""
-    filter = {
-        "$or": [
-            {"Place Name": {"$regex": query_str, "$options": "i"}},
-            {"Country": {"$regex": query_str, "$options": "i"}},
-        ]
-    }
-    project = {"Best Time To Visit": 1, "_id": 0}
-
-    res = collection.find_one(filter=filter, projection=project)
+    places = lookup_places(query_str, ["Place Name", "Country"], ["Best Time To Visit"], limit=1)
+    res = places[0] if places else None
     logger.info(f"Found best time to visit for: {query_str}")
-    return str(res)
+    return format_response(res)
 
 # Setup bedrock
+@lru_cache(maxsize=None)
 def setup_bedrock():
-    """Initialize the Bedrock runtime."""
+    """Initialize the Bedrock runtime, once per container."""
+    import boto3
+
     logger.info("Setting up Bedrock runtime client")
     return boto3.client(
         service_name="bedrock-runtime",
@@ -106,103 +124,156 @@ def setup_bedrock():
     )
 
 
+@lru_cache(maxsize=None)
+def get_embeddings(model_id):
+    """Create the embeddings model, once per container and model."""
+    from langchain_aws.embeddings import BedrockEmbeddings
+
+    return BedrockEmbeddings(
+        client=setup_bedrock(),
+        model_id=model_id,
+    )
+
+
 @app.get("/get_place_semantically", description="Retrieve place information by place features")
 @tracer.capture_method
-def mongodb_search(query: Annotated[str,Query(description="place features")]) -> Annotated[str, Body(description="Places and their details")]:
+def mongodb_search(query: Annotated[str,Query(description="place features")],
+                   country: Annotated[Optional[str], Query(description="Only places in this country")] = None,
+                   month: Annotated[Optional[str], Query(description="Only places best visited in this month, e.g. March")] = None,
+                   filters: Annotated[Optional[str], Query(description="JSON object of further indexed fields and the value "
+                                                                       "(or list of values) to match")] = None,
+                   ) -> Annotated[str, Body(description="Places and their details")]:
     logger.info(f"Performing semantic search for place features: {query}")
-    bedrock_runtime = setup_bedrock()
-    embeddings = BedrockEmbeddings(
-        client=bedrock_runtime,
-        model_id="amazon.titan-embed-text-v1",
-    )
-    
-    client = get_mongo_client()
-    collection = get_travel_collection(client)
-    
+    try:
+        search_filter = vector_filter(country, month, json.loads(filters) if filters else None)
+    except ValueError as e:
+        logger.warning(f"Invalid semantic search filter: {e}")
+        return f"Invalid filter: {e}"
+    model_id = "amazon.titan-embed-text-v1"
+
+    def embed(text):
+        logger.info("Generating embeddings for query")
+        return get_embeddings(model_id).embed_documents([text])[0]
+
     field_name_to_be_vectorized = "About Place"
 
-    logger.info("Generating embeddings for query")
-    text_as_embeddings = embeddings.embed_documents([query])
-    embedding_value = text_as_embeddings[0]
+    with timer.stage("embedding"):
+        embedding_value = embedding_cache.get(model_id, query, embed)
+    logger.info("Embedding cache stats", extra=embedding_cache.stats())
 
     # get the vector search results based on the filter conditions.
-    logger.info("Performing vector search in MongoDB")
-    response = collection.aggregate(
-        [
-            {
-                "$vectorSearch": {
-                    "index": "travel_vector_index",
-                    "path": "details_embedding",
-                    "queryVector": embedding_value,
-                    "numCandidates": 200,
-                    "limit": 10,
-                }
-            },
-            {
-                "$project": {
-                    "score": {"$meta": "vectorSearchScore"},
-                    field_name_to_be_vectorized: 1,
-                    "_id": 0,
-                }
-            },
-        ]
-    )
+    logger.info(f"Performing vector search in MongoDB, filter: {search_filter}")
+    # Over-fetched with their embeddings, CONTEXT_RESULTS of them are picked for diversity
+    fetch_k = max(CONTEXT_FETCH_K, CONTEXT_RESULTS)
+    candidates = num_candidates("travel.asia", fetch_k, max(200, 10 * fetch_k))
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "index": "travel_vector_index",
+                "path": "details_embedding",
+                "queryVector": encode_vector(embedding_value),
+                "numCandidates": candidates,
+                "limit": fetch_k,
+                # Narrowed inside the index, the filter fields are part of the vector index definition
+                **({"filter": search_filter} if search_filter else {}),
+            }
+        },
+        {
+            "$project": {
+                "score": {"$meta": "vectorSearchScore"},
+                field_name_to_be_vectorized: 1,
+                "details_embedding": 1,
+                "_id": 0,
+            }
+        },
+    ]
+
+    def fetch(vector):
+        # The local index has no filter fields, filtered searches always go to Atlas
+        if not search_filter and local_index_ready():
+            # Same candidates from the in-process index, no Atlas round-trip unless the snapshot is refreshed
+            with timer.stage("query") as stage:
+                docs = vector_index.search(vector, fetch_k, num_candidates=candidates, with_vectors=True)
+                stage.count = len(docs)
+            return docs
+        return atlas.run(lambda client: timer.fetch(lambda: get_travel_collection(client).aggregate(pipeline)))
+
+    def search(vector):
+        docs = fetch(vector)
+        # Reranked before caching, so cached results hold no embeddings
+        with timer.stage("rerank") as stage:
+            vectors = [decode_vector(doc.pop("details_embedding")) for doc in docs]
+            docs = [docs[row] for row in mmr(vector, vectors, CONTEXT_RESULTS)]
+            stage.count = len(docs)
+        return docs
 
-    # Result is a list of docs with the array fields
-    docs = list(response)
+    # Result is a list of docs with the array fields, in the order they were picked
+    docs = result_cache.get(embedding_value, search, scope=dumps(search_filter))
+    logger.info("Semantic cache stats", extra=result_cache.stats())
     logger.info(f"Found {len(docs)} results from vector search")
 
     # Extract an array field from the docs
     array_field = [doc[field_name_to_be_vectorized] for doc in docs]
 
-    # Join array elements into a string
-    llm_input_text = "\n \n".join(str(elem) for elem in array_field)
-
-    # utility
-    newline, bold, unbold = "\n", "\033[1m", "\033[0m"
-    logger.info(
-        newline
-        + bold
-        + "Given Input From MongoDB Vector Search: "
-        + unbold
-        + newline
-        + llm_input_text
-        + newline
-    )
+    # Join array elements into a string within the context budget
+    with timer.stage("format") as stage:
+        llm_input_text = pack_context(array_field)
+        stage.bytes = len(llm_input_text)
+
+    payload_log.info("Given Input From MongoDB Vector Search", results=len(docs),
+                     context_chars=len(llm_input_text), context=llm_input_text)
 
     return llm_input_text
 
 @logger.inject_lambda_context
 @tracer.capture_lambda_handler
+@timer.flush_after
 def lambda_handler(event: dict, context: LambdaContext):
     logger.info("Lambda handler invoked")
-    return app.resolve(event, context)
+    try:
+        return app.resolve(event, context)
+    finally:
+        logger.info("Atlas client cache stats", extra=atlas.stats())
 
-def get_secret(secret_name):
+def local_index_ready():
     """
-    Retrieve secret from AWS Secrets Manager
+    Whether the local vector index can answer searches, refreshing it when
+    due. A missing snapshot is only built at init (see warmup), and a failed
+    refresh leaves searches to $vectorSearch
     """
-    client = boto3.client(
-        service_name='secretsmanager'
-    )
+    if vector_index is None:
+        return False
+    if vector_index.is_stale():
+        try:
+            atlas.run(lambda client: vector_index.refresh(get_travel_collection(client), build=vector_index.ready()))
+        except Exception as e:
+            logger.warning(f"Local vector index refresh failed, using $vectorSearch: {e}")
+    return vector_index.ready()
 
+def get_mongo_client():
+    """
+    Return the container-wide MongoDB client, see mongo_client.AtlasClientManager
+    """
+    return atlas.get_client()
+
+def warmup():
+    """
+    Resolve the Atlas secret, open the connection pool, create the Bedrock
+    clients and load (or build) the local vector index snapshot while Lambda
+    initializes the container, so the first invocation does not pay for them. Failures are logged and left to the first request.
+    """
     try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-    except ClientError as e:
-        logger.error(f"Error retrieving secret {secret_name}: {e}")
-        raise e
-    else:
-        if 'SecretString' in get_secret_value_response:
-            logger.info(f"Successfully retrieved secret {secret_name}")
-            return get_secret_value_response['SecretString']
+        atlas.run(lambda client: client.admin.command("ping"))
+        get_embeddings("amazon.titan-embed-text-v1")
+        if vector_index is not None:
+            atlas.run(lambda client: vector_index.refresh(get_travel_collection(client)))
+        logger.info("Warmup finished", extra=atlas.stats())
+    except Exception as e:
+        logger.warning(f"Warmup failed: {e}")
 
-def get_mongo_client():
-    mongodb_uri = get_secret("workshop/atlas_secret")  # Replace with your secret name
-    logger.info("Creating MongoDB client connection")
-    client = MongoClient(mongodb_uri)
-    return client
+
+if os.environ.get("WARMUP_ON_INIT", "false").lower() == "true":
+    warmup()
 
 
 if __name__ == "__main__":  
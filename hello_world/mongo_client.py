@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+
+from aws_lambda_powertools import Logger
+
+from atlas_client import create_client
+from stage_timing import timer
+
+logger = Logger(child=True)
+
+ATLAS_SECRET_NAME = os.environ.get("ATLAS_SECRET_NAME", "workshop/atlas_secret")  # Replace with your secret name
+ATLAS_SECRET_TTL = int(os.environ.get("ATLAS_SECRET_TTL", "900"))
+
+# Server error codes that mean the credentials in the cached secret are no longer valid
+AUTH_ERROR_CODES = (18, 8000)
+
+
+def get_secret(secret_name):
+    """
+    Retrieve secret from AWS Secrets Manager
+    """
+    import boto3
+    from botocore.exceptions import ClientError
+
+    client = boto3.client(
+        service_name='secretsmanager'
+    )
+
+    try:
+        get_secret_value_response = client.get_secret_value(
+            SecretId=secret_name
+        )
+    except ClientError as e:
+        logger.error(f"Error retrieving secret {secret_name}: {e}")
+        raise e
+    else:
+        if 'SecretString' in get_secret_value_response:
+            logger.info(f"Successfully retrieved secret {secret_name}")
+            return get_secret_value_response['SecretString']
+
+
+class AtlasClientManager:
+    """
+    Keeps one pooled MongoClient per Lambda container.
+
+    boto3 and pymongo are only imported on first use, so routes that never
+    touch the database do not pay for them at cold start.
+
+    The Atlas connection string is cached for `secret_ttl` seconds. When the
+    TTL expires the secret is fetched again and the client is only rebuilt if
+    the connection string actually changed (e.g. after a rotation). An
+    authentication failure drops both the cached secret and the client so the
+    next attempt starts from fresh credentials.
+    """
+
+    def __init__(self, secret_name=ATLAS_SECRET_NAME, secret_ttl=ATLAS_SECRET_TTL):
+        self.secret_name = secret_name
+        self.secret_ttl = secret_ttl
+        self._lock = threading.Lock()
+        self._uri = None
+        self._uri_fetched_at = 0.0
+        self._client = None
+        self._client_uri = None
+        self._counters = {
+            "secret_hits": 0,
+            "secret_misses": 0,
+            "client_hits": 0,
+            "client_misses": 0,
+            "auth_refreshes": 0,
+        }
+
+    def _get_uri(self):
+        now = time.monotonic()
+        if self._uri is not None and now - self._uri_fetched_at < self.secret_ttl:
+            self._counters["secret_hits"] += 1
+            return self._uri
+        self._counters["secret_misses"] += 1
+        with timer.stage("secret"):
+            self._uri = get_secret(self.secret_name)
+        self._uri_fetched_at = now
+        return self._uri
+
+    def get_client(self):
+        """Return the cached client, creating it on first use or after the secret changed."""
+        with self._lock:
+            uri = self._get_uri()
+            if self._client is not None and self._client_uri == uri:
+                self._counters["client_hits"] += 1
+                return self._client
+            self._counters["client_misses"] += 1
+            if self._client is not None:
+                logger.info("Atlas secret changed, replacing MongoDB client")
+                self._client.close()
+            logger.info("Creating MongoDB client connection")
+            self._client = create_client(uri)
+            self._client_uri = uri
+            return self._client
+
+    def invalidate(self):
+        """Forget the cached secret and close the cached client."""
+        with self._lock:
+            self._uri = None
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+
+    def run(self, operation):
+        """
+        Call `operation(client)` with the cached client.
+
+        If the server rejects the credentials, the secret is refreshed and the
+        operation is retried once with a new client.
+        """
+        from pymongo.errors import OperationFailure
+
+        try:
+            return operation(self.get_client())
+        except OperationFailure as e:
+            if e.code not in AUTH_ERROR_CODES:
+                raise
+            logger.warning(f"MongoDB authentication failed ({e.code}), refreshing Atlas secret")
+            self._counters["auth_refreshes"] += 1
+            self.invalidate()
+            return operation(self.get_client())
+
+    def stats(self):
+        return dict(self._counters)
+
+
+atlas = AtlasClientManager()
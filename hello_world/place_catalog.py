@@ -0,0 +1,97 @@
+import os
+import time
+from bisect import bisect_left
+
+from aws_lambda_powertools import Logger
+
+from lookup_fields import DERIVED_FIELDS, LOOKUP_FIELDS, content_hash_field, normalize_lookup
+
+logger = Logger(child=True)
+
+PLACE_CATALOG = os.environ.get("PLACE_CATALOG", "false").lower() == "true"
+PLACE_CATALOG_TTL = int(os.environ.get("PLACE_CATALOG_TTL", "300"))
+PLACE_CATALOG_MAX_AGE = int(os.environ.get("PLACE_CATALOG_MAX_AGE", "3600"))
+
+CATALOG_PROJECTION = {"_id": 0, "details_embedding": 0, content_hash_field("details_embedding"): 0,
+                      **{field: 0 for field in DERIVED_FIELDS}}
+
+
+class PlaceCatalog:
+    """
+    In-process copy of the travel collection for the lookup routes.
+
+    Places are loaded once per container. For every lookup field a sorted
+    list of (normalized value, place position) pairs acts as the prefix
+    index: exact and prefix matches are a binary search followed by a short
+    scan. Every `ttl` seconds a cheap version stamp (document count and
+    newest _id) is read and the catalog reloads when it changed, or
+    unconditionally after `max_age` seconds so in-place updates are picked
+    up as well.
+    """
+
+    def __init__(self, ttl=PLACE_CATALOG_TTL, max_age=PLACE_CATALOG_MAX_AGE):
+        self.ttl = ttl
+        self.max_age = max_age
+        self._places = []
+        self._index = {}
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    def is_stale(self):
+        return not self._places or time.monotonic() - self._checked_at >= self.ttl
+
+    @staticmethod
+    def version(collection):
+        newest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        return collection.estimated_document_count(), newest["_id"] if newest else None
+
+    def refresh(self, collection):
+        """Reload the places if the catalog is stale and the collection changed."""
+        if not self.is_stale():
+            return
+        now = time.monotonic()
+        version = self.version(collection)
+        if version != self._version or now - self._loaded_at >= self.max_age:
+            self.load(collection, version)
+        self._checked_at = now
+
+    def load(self, collection, version=None):
+        start = time.perf_counter()
+        places = list(collection.find({}, CATALOG_PROJECTION))
+        index = {}
+        for source in LOOKUP_FIELDS:
+            entries = sorted(
+                (normalize_lookup(place[source]), position)
+                for position, place in enumerate(places)
+                if place.get(source) is not None
+            )
+            index[source] = ([key for key, _ in entries], [position for _, position in entries])
+        self._places, self._index, self._version = places, index, version
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(places)} places into the catalog in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def _matches(self, source, value, prefix):
+        keys, positions = self._index.get(source, ([], []))
+        i = bisect_left(keys, value)
+        while i < len(keys) and (keys[i].startswith(value) if prefix else keys[i] == value):
+            yield positions[i]
+            i += 1
+
+    def find(self, query_str, sources, limit=0):
+        """
+        Same matching rules as place_lookup.find_places: exact matches on any
+        of `sources` first, prefix matches only when there is no exact one
+        """
+        value = normalize_lookup(query_str)
+        for prefix in (False, True):
+            positions = set()
+            for source in sources:
+                positions.update(self._matches(source, value, prefix))
+            if positions:
+                positions = sorted(positions)
+                return [self._places[p] for p in (positions[:limit] if limit else positions)]
+        return []
+
+
+place_catalog = PlaceCatalog() if PLACE_CATALOG else None
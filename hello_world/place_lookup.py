@@ -0,0 +1,44 @@
+import os
+
+from aws_lambda_powertools import Logger
+
+from lookup_fields import exact_filter, prefix_filter
+from stage_timing import timer
+
+logger = Logger(child=True)
+
+# Atlas Search index used when neither an exact nor a prefix match exists, disabled when unset
+PLACE_SEARCH_INDEX = os.environ.get("PLACE_SEARCH_INDEX")
+PLACE_SEARCH_LIMIT = int(os.environ.get("PLACE_SEARCH_LIMIT", "20"))
+
+
+def find_places(collection, query_str, sources, projection, limit=0):
+    """
+    Find places whose `sources` fields match `query_str`.
+
+    Tries an exact match on the normalized lookup fields, then a prefix match,
+    both served by the lookup indexes. Only when both come back empty and
+    PLACE_SEARCH_INDEX is set, falls back to a fuzzy Atlas Search query on
+    the original fields.
+    """
+    for kind, filter in (("exact", exact_filter(query_str, sources)), ("prefix", prefix_filter(query_str, sources))):
+        docs = timer.fetch(lambda: collection.find(filter, projection, limit=limit))
+        if docs:
+            logger.info(f"Found {len(docs)} places with an {kind} match on {sources}")
+            return docs
+
+    if not PLACE_SEARCH_INDEX:
+        return []
+
+    logger.info(f"No indexed match for {query_str}, falling back to Atlas Search")
+    pipeline = [
+        {
+            "$search": {
+                "index": PLACE_SEARCH_INDEX,
+                "text": {"query": query_str, "path": sources, "fuzzy": {"maxEdits": 1}},
+            }
+        },
+        {"$limit": limit or PLACE_SEARCH_LIMIT},
+        {"$project": projection},
+    ]
+    return timer.fetch(lambda: collection.aggregate(pipeline))
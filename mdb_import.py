@@ -1,72 +1,220 @@
+import argparse
 import csv
+import json
 import logging
-from pymongo import MongoClient
-import boto3
-from botocore.exceptions import ClientError
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import OperationFailure
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared'))
+from vector_codec import VECTOR_ENCODINGS, encode_vector
+from lookup_fields import add_lookup_fields, ensure_lookup_indexes
+from vector_filters import VECTOR_FILTER_FIELDS, ensure_vector_index
+from atlas_client import get_secret
+
 logger = logging.getLogger('mdb_import')
 
-def get_secret(secret_name):
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import trip recommendations from CSV into MongoDB Atlas")
+    parser.add_argument("--csv", default="./anthropic-travel-agency.trip_recommendations.csv",
+                        help="CSV file to import")
+    parser.add_argument("--db", default="travel")
+    parser.add_argument("--collection", default="asia")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="Number of rows sent to MongoDB per bulk write")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes parsing batches in parallel, 1 parses in the writer process")
+    parser.add_argument("--vector-encoding", choices=VECTOR_ENCODINGS, default="array",
+                        help="Store details_embedding as an array of doubles or a packed float32/int8 binary vector")
+    parser.add_argument("--key", action="append", dest="keys",
+                        help="Field(s) identifying a row, used to upsert idempotently (default: index)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (default: <csv>.checkpoint)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore an existing checkpoint and import from the first row")
+    parser.add_argument("--vector-index", default="travel_vector_index",
+                        help="Atlas Vector Search index created or updated on details_embedding")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Dimensions of details_embedding")
+    parser.add_argument("--similarity", choices=["cosine", "dotProduct", "euclidean"], default="cosine")
+    parser.add_argument("--filter-field", action="append", dest="filter_fields",
+                        help="Further field indexed as a vector search filter (default: VECTOR_FILTER_FIELDS)")
+    args = parser.parse_args()
+    args.keys = args.keys or ["index"]
+    args.checkpoint = args.checkpoint or args.csv + ".checkpoint"
+    args.filter_fields = args.filter_fields or VECTOR_FILTER_FIELDS
+    return args
+
+
+def row_layout(header):
     """
-    Retrieve secret from AWS Secrets Manager
+    Split the CSV header into the details_embedding column positions and the
+    (position, name) pairs of every other column, once per file
     """
-    client = boto3.client(
-        service_name='secretsmanager'
-    )
+    embedding_columns = [i for i, column in enumerate(header) if column.startswith('details_embedding')]
+    other_columns = [(i, column) for i, column in enumerate(header) if not column.startswith('details_embedding')]
+    return embedding_columns, other_columns
 
-    try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
-    except ClientError as e:
-        logger.error(f"Error retrieving secret {secret_name}: {e}")
-        raise e
+
+def parse_batch(layout, first_index, rows, vector_encoding="array"):
+    """
+    Build the MongoDB documents for a batch of raw CSV rows. The embedding
+    columns of the whole batch are converted to floats in one NumPy call and
+    accumulated into a single details_embedding vector per document, next to
+    the normalized lookup fields
+    """
+    embedding_columns, other_columns = layout
+    embeddings = np.array([[row[i] for i in embedding_columns] for row in rows]).astype(np.float64)
+    if vector_encoding == "array":
+        embeddings = embeddings.tolist()
     else:
-        if 'SecretString' in get_secret_value_response:
-            logger.info(f"Successfully retrieved secret {secret_name}")
-            return get_secret_value_response['SecretString']
-
-# Get the MongoDB connection string from Secrets Manager
-logger.info("Retrieving MongoDB connection string from Secrets Manager")
-mongodb_uri = get_secret("workshop/atlas_secret")  # Replace with your secret name
-
-# MongoDB connection
-logger.info("Connecting to MongoDB Atlas")
-client = MongoClient(mongodb_uri)
-
-db = client['travel']
-collection = db['asia']
-
-# CSV file path
-csv_file_path = './anthropic-travel-agency.trip_recommendations.csv'
-
-logger.info('Starting data import from CSV to MongoDB')
-
-index = 1
-with open(csv_file_path, mode='r') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        # logger.debug(f"Processing row type: {type(row)}")
-        row['index'] = index
-        index += 1
-        # loop over columns and accumulate all detail_embedding into an array
-        detail_embedding = []
-        new_row = {}
-        for column in row.keys():
-            if column.startswith('details_embedding'):
-                detail_embedding.append(float(row[column]))
-            else:
-                new_row[column] = row[column]
-        
-        new_row['details_embedding'] = detail_embedding
-
-        collection.insert_one(new_row)
-        if index % 25 == 0:
-            logger.info(f'Inserted {index} rows')
-
-logger.info('Finished import successfully')
+        embeddings = [encode_vector(embedding, vector_encoding) for embedding in embeddings]
+    docs = []
+    for offset, (row, embedding) in enumerate(zip(rows, embeddings)):
+        new_row = {column: row[i] for i, column in other_columns}
+        new_row['index'] = first_index + offset
+        new_row['details_embedding'] = embedding
+        docs.append(add_lookup_fields(new_row))
+    return docs
+
+
+def read_batches(csv_path, batch_size, rows_done):
+    """
+    Yield (header, first row index, rows) for the rows after rows_done, batch_size rows at a time
+    """
+    with open(csv_path, mode='r', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        batch, first_index = [], rows_done + 1
+        for index, row in enumerate(reader, start=1):
+            if index <= rows_done:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield header, first_index, batch
+                batch, first_index = [], index + 1
+        if batch:
+            yield header, first_index, batch
+
+
+def parsed_batches(batches, workers, vector_encoding="array"):
+    """
+    Parse batches on a pool of `workers` processes and yield the documents in
+    file order, keeping at most two batches per worker in flight
+    """
+    if workers <= 1:
+        for header, first_index, rows in batches:
+            yield parse_batch(row_layout(header), first_index, rows, vector_encoding)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        layout = None
+        for header, first_index, rows in batches:
+            layout = layout or row_layout(header)
+            pending.append(pool.submit(parse_batch, layout, first_index, rows, vector_encoding))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_checkpoint(checkpoint_path, csv_path):
+    """
+    Return the number of rows already imported from csv_path, 0 when there is
+    no checkpoint or it was written for a different version of the file
+    """
+    if not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("csv") != os.path.abspath(csv_path) or checkpoint.get("size") != os.path.getsize(csv_path):
+        logger.warning(f"Checkpoint {checkpoint_path} was written for another file, starting from the first row")
+        return 0
+    return checkpoint["rows_done"]
+
+
+def write_checkpoint(checkpoint_path, csv_path, rows_done):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"csv": os.path.abspath(csv_path), "size": os.path.getsize(csv_path), "rows_done": rows_done}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def write_batch(collection, batch, keys):
+    """
+    Upsert a batch of documents on their natural key in one unordered bulk write
+    """
+    requests = [ReplaceOne({key: doc[key] for key in keys}, doc, upsert=True) for doc in batch]
+    return collection.bulk_write(requests, ordered=False)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # Get the MongoDB connection string from Secrets Manager
+    logger.info("Retrieving MongoDB connection string from Secrets Manager")
+    mongodb_uri = get_secret("workshop/atlas_secret")  # Replace with your secret name
+
+    # MongoDB connection
+    logger.info("Connecting to MongoDB Atlas")
+    client = MongoClient(mongodb_uri)
+
+    db = client[args.db]
+    collection = db[args.collection]
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    rows_done = read_checkpoint(args.checkpoint, args.csv)
+    if rows_done:
+        logger.info(f"Resuming import after row {rows_done} (checkpoint {args.checkpoint})")
+
+    # Every upsert matches on the key, without an index each one scans the collection
+    logger.info(f'Creating unique index on {", ".join(args.keys)}')
+    try:
+        collection.create_index([(key, 1) for key in args.keys], unique=True)
+    except OperationFailure as e:
+        logger.error(f'Could not create a unique index on {", ".join(args.keys)}, '
+                     f'the collection holds duplicate keys: {e}')
+        raise
+
+    logger.info('Starting data import from CSV to MongoDB')
+
+    started = time.perf_counter()
+    imported = 0
+    for batch in parsed_batches(read_batches(args.csv, args.batch_size, rows_done), args.workers,
+                                 args.vector_encoding):
+        write_batch(collection, batch, args.keys)
+        imported += len(batch)
+        last_index = batch[-1]['index']
+        write_checkpoint(args.checkpoint, args.csv, last_index)
+        elapsed = time.perf_counter() - started
+        logger.info(f'Imported {last_index} rows ({imported / elapsed:.0f} rows/sec)')
+
+    logger.info('Creating lookup indexes')
+    backfilled = ensure_lookup_indexes(collection)
+    if backfilled:
+        logger.info(f'Added lookup fields to {backfilled} existing documents')
+
+    logger.info(f'Creating vector search index {args.vector_index}')
+    try:
+        status = ensure_vector_index(collection, args.vector_index, 'details_embedding', args.dimensions,
+                                     args.similarity, args.filter_fields)
+        logger.info(f'Vector search index {args.vector_index} {status}')
+    except OperationFailure as e:
+        logger.warning(f'Could not create vector search index {args.vector_index} (Atlas only): {e}')
+
+    elapsed = time.perf_counter() - started
+    logger.info(f'Finished import successfully: {imported} rows in {elapsed:.1f}s '
+                f'({imported / elapsed if elapsed else 0:.0f} rows/sec)')
+
+
+if __name__ == "__main__":
+    main()
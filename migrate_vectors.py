@@ -0,0 +1,105 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import bson
+import numpy as np
+from pymongo import MongoClient, UpdateOne
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared'))
+from vector_codec import VECTOR_ENCODINGS, decode_vector, encode_vector
+from atlas_client import get_secret
+
+logger = logging.getLogger('migrate_vectors')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert stored embeddings to packed BSON binary vectors, or compare encodings")
+    parser.add_argument("--db", default="travel")
+    parser.add_argument("--collection", default="asia")
+    parser.add_argument("--field", default="details_embedding", help="Field holding the embeddings")
+    parser.add_argument("--encoding", choices=VECTOR_ENCODINGS, default="float32",
+                        help="Encoding written by the migration")
+    parser.add_argument("--target-field", default=None,
+                        help="Write the encoded vectors to this field instead of replacing --field")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--compare", action="store_true",
+                        help="Only report sizes and recall of every encoding on a sample, do not write")
+    parser.add_argument("--sample", type=int, default=1000, help="Documents sampled by --compare")
+    parser.add_argument("--queries", type=int, default=100, help="Sampled vectors used as queries by --compare")
+    parser.add_argument("-k", type=int, default=10, help="Cut-off for recall@k in --compare")
+    return parser.parse_args()
+
+
+def migrate(collection, field, encoding, target_field, batch_size):
+    """
+    Rewrite every embedding not yet stored with the requested kind of
+    encoding (binary, or array when converting back). Documents already
+    converted are skipped by the query, so an interrupted run can simply be
+    restarted
+    """
+    target_field = target_field or field
+    if target_field == field:
+        query = {field: {"$type": "binData" if encoding == "array" else "array"}}
+    else:
+        query = {field: {"$exists": True}, target_field: {"$exists": False}}
+
+    started = time.perf_counter()
+    migrated = 0
+    requests = []
+    for doc in collection.find(query, {field: 1}, batch_size=batch_size):
+        requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": {target_field: encode_vector(decode_vector(doc[field]), encoding)}}))
+        if len(requests) >= batch_size:
+            migrated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+            logger.info(f"Migrated {migrated} documents ({migrated / (time.perf_counter() - started):.0f} docs/sec)")
+    if requests:
+        migrated += collection.bulk_write(requests, ordered=False).modified_count
+    logger.info(f"Finished migration: {migrated} documents in {time.perf_counter() - started:.1f}s")
+
+
+def top_k(matrix, queries, k):
+    normalized = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ normalized.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def compare(collection, field, sample, queries, k):
+    """
+    Report the BSON size of the embedding field and the cosine recall@k of
+    each encoding against the original float64 vectors, on a random sample
+    """
+    docs = list(collection.aggregate([{"$sample": {"size": sample}}, {"$project": {field: 1}}]))
+    originals = np.array([decode_vector(doc[field]) for doc in docs], dtype=np.float64)
+    query_vectors = originals[:queries]
+    truth = top_k(originals, query_vectors, k)
+    logger.info(f"Comparing encodings on {len(docs)} documents, {len(query_vectors)} queries, recall@{k}")
+
+    for encoding in VECTOR_ENCODINGS:
+        encoded = [encode_vector(vector, encoding) for vector in originals]
+        size = np.mean([len(bson.encode({field: value})) for value in encoded])
+        decoded = np.array([decode_vector(value) for value in encoded], dtype=np.float64)
+        found = top_k(decoded, query_vectors, k)
+        recall = np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)])
+        logger.info(f"{encoding:>8}: {size:,.0f} bytes per {field}, recall@{k} {recall:.4f}")
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    logger.info("Retrieving MongoDB connection string from Secrets Manager")
+    client = MongoClient(get_secret("workshop/atlas_secret"))  # Replace with your secret name
+    collection = client[args.db][args.collection]
+
+    if args.compare:
+        compare(collection, args.field, args.sample, args.queries, args.k)
+    else:
+        migrate(collection, args.field, args.encoding, args.target_field, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
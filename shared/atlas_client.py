@@ -0,0 +1,86 @@
+import logging
+import os
+import warnings
+
+logger = logging.getLogger(__name__)
+
+# MongoClient options shared by every function. A Lambda container serves one
+# request at a time, so a handful of pooled connections covers the concurrent
+# legs of a search; short selection and connect timeouts fail a request fast
+# when Atlas is unreachable instead of stalling it for the 30s default, and
+# MONGO_TIMEOUT_MS bounds every operation (pymongo sends the remaining time as
+# maxTimeMS). Compressors are offered to the server in order and the first one
+# it supports is used; pymongo leaves out those whose library is not installed
+# (pymongo[snappy,zstd] installs them).
+MONGO_COMPRESSORS = [name.strip() for name in os.environ.get("MONGO_COMPRESSORS", "zstd,snappy,zlib").split(",")
+                     if name.strip()]
+MONGO_ZLIB_LEVEL = int(os.environ.get("MONGO_ZLIB_LEVEL", "-1"))
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "4"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", "10000"))
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")
+MONGO_APP_NAME = os.environ.get("MONGO_APP_NAME") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+
+
+def client_options(**overrides):
+    """
+    MongoClient keyword options from the MONGO_* environment variables,
+    `overrides` (pymongo option names) taking precedence. A timeout or idle
+    time of 0 leaves that option unset
+    """
+    options = {
+        "compressors": MONGO_COMPRESSORS,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+    }
+    if "zlib" in MONGO_COMPRESSORS:
+        options["zlibCompressionLevel"] = MONGO_ZLIB_LEVEL
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = MONGO_MAX_IDLE_TIME_MS
+    if MONGO_TIMEOUT_MS:
+        options["timeoutMS"] = MONGO_TIMEOUT_MS
+    if MONGO_APP_NAME:
+        options["appname"] = MONGO_APP_NAME
+    options.update(overrides)
+    return options
+
+
+def create_client(uri, **overrides):
+    """
+    MongoClient for `uri` configured with client_options()
+    """
+    from pymongo import MongoClient
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        client = MongoClient(uri, **client_options(**overrides))
+    for warning in caught:
+        # A compressor whose library is missing is expected, the next one is offered instead
+        if str(warning.message).startswith("Wire protocol compression"):
+            logger.info(str(warning.message))
+        else:
+            warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+    return client
+
+
+def get_secret(secret_name):
+    """
+    Retrieve a secret string from AWS Secrets Manager, e.g. the Atlas connection string
+    """
+    import boto3
+    from botocore.exceptions import ClientError
+
+    client = boto3.client(service_name='secretsmanager')
+    try:
+        response = client.get_secret_value(SecretId=secret_name)
+    except ClientError as e:
+        logger.error(f"Error retrieving secret {secret_name}: {e}")
+        raise
+    logger.info(f"Successfully retrieved secret {secret_name}")
+    return response.get('SecretString')
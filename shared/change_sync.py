@@ -0,0 +1,270 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from embedding_backfill import AdaptiveBackoff, EmbeddingBackfill, content_hash, embedding_action
+from lookup_fields import (BEST_MONTHS_SOURCE, DERIVED_FIELDS, LOOKUP_FIELDS, add_lookup_fields, content_hash_field,
+                           ensure_lookup_indexes)
+from vector_codec import encode_vector
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_SOURCES = [*LOOKUP_FIELDS, BEST_MONTHS_SOURCE]
+
+# The resume token is older than the oldest oplog entry, or the stream cannot be resumed
+HISTORY_LOST_CODES = (280, 286)
+
+
+class ResumeTokenStore:
+    """
+    Persists the resume token of a change stream in a MongoDB collection, one
+    document per sync worker, so a restarted worker continues where it stopped
+    """
+
+    def __init__(self, collection, name):
+        self.collection = collection
+        self.name = name
+        self._saved = None
+
+    def load(self):
+        doc = self.collection.find_one({"_id": self.name})
+        self._saved = doc["resume_token"] if doc else None
+        return self._saved
+
+    def save(self, token):
+        if token is None or token == self._saved:
+            return
+        self.collection.update_one(
+            {"_id": self.name},
+            {"$set": {"resume_token": token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        self._saved = token
+
+    def clear(self):
+        self.collection.delete_one({"_id": self.name})
+        self._saved = None
+
+
+class ChangeSync:
+    """
+    Keeps the embedding and the derived lookup fields of a collection in
+    step with its source fields by tailing a change stream.
+
+    Only inserts, replacements and updates touching a source field (or
+    removing the vector) pass the stream's $match, so the worker's own
+    writes never come back to it. Changes are batched, the latest per
+    document winning, and applied when `batch_size` documents are pending,
+    when the stream has nothing more to return or after `flush_ms`. For
+    every document the derived fields are recomputed and the text is
+    embedded again only if its content hash changed, as in
+    EmbeddingBackfill; a vector without a hash, e.g. from a fresh import,
+    is adopted unless the event updated the text but not the vector. The resume token is saved after each applied batch,
+    so after a crash the last batch at most is processed again. When the
+    token has fallen off the oplog or the stream is invalidated, the stream
+    restarts from now after a full catch-up pass.
+    """
+
+    def __init__(self, collection, state, embed=None, model_id=None, source_field="About Place",
+                 vector_field="details_embedding", vector_encoding="array", lookup_fields=True,
+                 batch_size=100, flush_ms=1000, workers=4, embed_batch=8, backoff=None):
+        self.collection = collection
+        self.state = state
+        self.embed = embed
+        self.model_id = model_id
+        self.source_field = source_field
+        self.vector_field = vector_field
+        self.hash_field = content_hash_field(vector_field)
+        self.vector_encoding = vector_encoding
+        self.lookup_fields = lookup_fields
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.workers = workers
+        self.embed_batch = embed_batch
+        self.backoff = backoff or AdaptiveBackoff()
+        self._counters = {"events": 0, "batches": 0, "embedded": 0, "updated": 0}
+
+    def sources(self):
+        sources = [self.source_field] if self.embed else []
+        if self.lookup_fields:
+            sources += LOOKUP_SOURCES
+        return sources
+
+    def pipeline(self):
+        sources = self.sources()
+        touches_source = {
+            "$anyElementTrue": [{
+                "$map": {
+                    "input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+                    "in": {"$in": ["$$this.k", sources]},
+                }
+            }]
+        }
+        return [
+            {"$match": {"$or": [
+                {"operationType": {"$in": ["insert", "replace"]}},
+                {"operationType": "update", "$expr": touches_source},
+                {"operationType": "update", "updateDescription.removedFields": {"$in": [*sources, self.vector_field]}},
+            ]}},
+            # Only whether the document has a vector matters, not the vector itself
+            {"$set": {f"fullDocument.{self.vector_field}": {
+                "$ne": [{"$type": f"$fullDocument.{self.vector_field}"}, "missing"]}}},
+        ]
+
+    def _derived(self, doc):
+        derived = add_lookup_fields({source: doc.get(source) for source in LOOKUP_SOURCES})
+        return {target: derived[target] for target in DERIVED_FIELDS
+                if target in derived and derived[target] != doc.get(target)}
+
+    def _embed(self, texts):
+        chunks = [texts[i:i + self.embed_batch] for i in range(0, len(texts), self.embed_batch)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(lambda chunk: self.backoff.call(self.embed, chunk), chunks)
+            return [vector for vectors in results for vector in vectors]
+
+    def apply(self, docs, stale_vectors=(), embeddings=True):
+        """
+        Recompute the derived fields and, with `embeddings`, the embeddings
+        of the full documents `docs`, returns the number of documents
+        updated. `stale_vectors` holds the ids of documents whose vector is
+        known to predate their text
+        """
+        from pymongo import UpdateOne
+
+        embed = self.embed if embeddings else None
+        sources = self.sources() if embed else [source for source in self.sources() if source != self.source_field]
+        updates, texts, embedding = {}, {}, {}
+        for doc in docs:
+            fields = self._derived(doc) if self.lookup_fields else {}
+            text = doc.get(self.source_field)
+            if embed and isinstance(text, str) and text.strip():
+                digest = content_hash(self.model_id, text)
+                has_vector = bool(doc.get(self.vector_field)) and doc["_id"] not in stale_vectors
+                action = embedding_action(digest, doc.get(self.hash_field), has_vector)
+                if action != "unchanged":
+                    fields[self.hash_field] = digest
+                if action == "embed":
+                    texts.setdefault(digest, text)
+                    embedding[doc["_id"]] = digest
+            if fields:
+                # Matching on the sources as well leaves a document changed meanwhile to its own event
+                guard = {source: doc.get(source) for source in sources}
+                updates[doc["_id"]] = ({"_id": doc["_id"], **guard}, fields)
+
+        if texts:
+            digests = list(texts)
+            vectors = dict(zip(digests, self._embed([texts[digest] for digest in digests])))
+            self._counters["embedded"] += len(digests)
+            for _id, digest in embedding.items():
+                updates[_id][1][self.vector_field] = encode_vector(vectors[digest], self.vector_encoding)
+
+        if not updates:
+            return 0
+        requests = [UpdateOne(filter, {"$set": fields}) for filter, fields in updates.values()]
+        updated = self.collection.bulk_write(requests, ordered=False).modified_count
+        self._counters["updated"] += updated
+        return updated
+
+    def catch_up(self):
+        """
+        Full pass over the collection, for when changes may have been missed
+        """
+        if self.lookup_fields:
+            ensure_lookup_indexes(self.collection)
+            # Sources changed while the stream was down left their derived fields behind
+            projection = {field: 1 for field in [*LOOKUP_SOURCES, *DERIVED_FIELDS]}
+            batch = []
+            for doc in self.collection.find({}, projection, batch_size=self.batch_size):
+                batch.append(doc)
+                if len(batch) >= self.batch_size:
+                    self.apply(batch, embeddings=False)
+                    batch = []
+            self.apply(batch, embeddings=False)
+        if self.embed:
+            EmbeddingBackfill(self.collection, self.embed, self.model_id, source_field=self.source_field,
+                              vector_field=self.vector_field, vector_encoding=self.vector_encoding,
+                              workers=self.workers, batch_size=self.embed_batch, backoff=self.backoff).run()
+
+    def _text_without_vector(self, change):
+        if change["operationType"] != "update":
+            return False
+        updated = change["updateDescription"].get("updatedFields", {})
+        return self.source_field in updated and self.vector_field not in updated
+
+    def _flush(self, stream, pending):
+        start = time.perf_counter()
+        # A document deleted before its update was looked up has no _id left
+        docs = [change["fullDocument"] for change in pending.values() if "_id" in (change.get("fullDocument") or {})]
+        stale = {_id for _id, change in pending.items() if self._text_without_vector(change)}
+        updated = self.apply(docs, stale)
+        self.state.save(stream.resume_token)
+        self._counters["batches"] += 1
+        oldest = min((change["wallTime"] for change in pending.values() if "wallTime" in change), default=None)
+        lag = f", {(datetime.now(timezone.utc) - oldest.replace(tzinfo=timezone.utc)).total_seconds():.1f}s behind" \
+            if oldest else ""
+        logger.info(f"Applied {len(pending)} changed documents, {updated} updated "
+                    f"in {(time.perf_counter() - start) * 1000:.0f}ms{lag}")
+        pending.clear()
+
+    def _tail(self, stream, stopped):
+        """
+        Apply the stream's changes until it closes or `stopped()`, returns
+        True when the stream was invalidated (the collection dropped or renamed)
+        """
+        pending, first_at = {}, None
+        while stream.alive and not stopped():
+            change = stream.try_next()
+            if change is not None and change["operationType"] == "invalidate":
+                if pending:
+                    self._flush(stream, pending)
+                return True
+            if change is not None:
+                self._counters["events"] += 1
+                pending[change["documentKey"]["_id"]] = change
+                first_at = first_at or time.monotonic()
+            if pending and (change is None or len(pending) >= self.batch_size
+                            or time.monotonic() - first_at >= self.flush_ms / 1000):
+                self._flush(stream, pending)
+                first_at = None
+            elif change is None:
+                # An idle stream's token still advances, keep the saved one recent
+                self.state.save(stream.resume_token)
+        if pending:
+            self._flush(stream, pending)
+        return False
+
+    def run(self, stopped=lambda: False, catch_up=False):
+        """
+        Tail the change stream until `stopped()` returns True. With
+        `catch_up`, a full pass runs first, once the stream is open so no
+        change made during the pass is missed
+        """
+        from pymongo.errors import OperationFailure
+
+        token = self.state.load()
+        while not stopped():
+            logger.info(f"Watching {self.collection.full_name} " + ("from the saved resume token" if token else "from now"))
+            try:
+                with self.collection.watch(self.pipeline(), full_document="updateLookup", resume_after=token,
+                                           batch_size=self.batch_size, max_await_time_ms=self.flush_ms) as stream:
+                    if catch_up:
+                        self.catch_up()
+                        catch_up = False
+                    if self._tail(stream, stopped):
+                        # An invalidate token cannot be resumed after, the collection starts over
+                        logger.warning(f"{self.collection.full_name} was dropped or renamed, "
+                                       f"watching from now after a full pass")
+                        self.state.clear()
+                        token, catch_up = None, True
+                        continue
+                    token = stream.resume_token
+            except OperationFailure as e:
+                if e.code not in HISTORY_LOST_CODES:
+                    raise
+                logger.warning(f"Cannot resume the change stream ({e}), catching up with a full pass")
+                self.state.clear()
+                token, catch_up = None, True
+
+    def stats(self):
+        return dict(self._counters)
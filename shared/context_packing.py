@@ -0,0 +1,88 @@
+import os
+
+# Context handed to the model by a semantic search. CONTEXT_FETCH_K candidates
+# are fetched with their embeddings and CONTEXT_RESULTS of them picked by
+# maximal marginal relevance: CONTEXT_MMR_LAMBDA of 1 ranks by similarity to
+# the query alone, lower values favour documents unlike those already picked.
+# The picked texts are then packed into CONTEXT_MAX_TOKENS, each cut to
+# CONTEXT_DOC_MAX_TOKENS; tokens are estimated as CHARS_PER_TOKEN characters.
+# A budget of 0 leaves the context (or the documents) uncut.
+CONTEXT_RESULTS = int(os.environ.get("CONTEXT_RESULTS", "10"))
+CONTEXT_FETCH_K = int(os.environ.get("CONTEXT_FETCH_K", "40"))
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", "1500"))
+CONTEXT_DOC_MAX_TOKENS = int(os.environ.get("CONTEXT_DOC_MAX_TOKENS", "300"))
+CHARS_PER_TOKEN = 4
+
+# A document cut shorter than this to fit the budget is left out instead
+MIN_DOC_CHARS = 200
+
+
+def mmr(query, vectors, limit, lambda_mult=CONTEXT_MMR_LAMBDA):
+    """
+    Positions of `limit` rows of `vectors` in maximal marginal relevance
+    order: each pick maximizes lambda_mult * similarity to `query` minus
+    (1 - lambda_mult) * its highest similarity to the rows already picked
+    """
+    import numpy as np
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+    query = np.asarray(query, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = vectors @ query
+    limit = min(limit, len(vectors))
+    if lambda_mult >= 1:
+        return [int(row) for row in np.argsort(-relevance, kind="stable")[:limit]]
+
+    similarity = vectors @ vectors.T
+    picked = [int(np.argmax(relevance))]
+    redundancy = similarity[picked[0]].copy()
+    available = np.ones(len(vectors), dtype=bool)
+    available[picked[0]] = False
+    while len(picked) < limit:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        row = int(np.argmax(scores))
+        picked.append(row)
+        available[row] = False
+        np.maximum(redundancy, similarity[row], out=redundancy)
+    return picked
+
+
+def truncate(text, max_chars):
+    """
+    `text` cut to at most `max_chars` characters at a word boundary, "..." marking the cut
+    """
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    cut = text[:max(max_chars - 3, 0)]
+    space = cut.rfind(" ")
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "..."
+
+
+def pack_context(texts, max_tokens=CONTEXT_MAX_TOKENS, doc_max_tokens=CONTEXT_DOC_MAX_TOKENS, separator="\n \n"):
+    """
+    Join `texts`, in order, into at most `max_tokens` (estimated) with each
+    text cut to `doc_max_tokens`. The last text that does not fit whole is
+    cut to the space left, or left out with the rest when too little is left
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    doc_max_chars = doc_max_tokens * CHARS_PER_TOKEN
+    packed, used = [], 0
+    for text in texts:
+        text = truncate(str(text), doc_max_chars)
+        room = max_chars - used - (len(separator) if packed else 0) if max_chars > 0 else len(text)
+        if len(text) > room:
+            if room >= MIN_DOC_CHARS:
+                packed.append(truncate(text, room))
+            break
+        packed.append(text)
+        used += len(text) + (len(separator) if len(packed) > 1 else 0)
+    return separator.join(packed)
@@ -0,0 +1,280 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from embeddings import TITAN_MODEL_ID, embed_titan
+from lookup_fields import content_hash_field
+from vector_codec import encode_vector
+
+logger = logging.getLogger(__name__)
+
+# Error codes of a Bedrock call rejected for exceeding the account's quota
+THROTTLE_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException")
+
+
+def content_hash(model_id, text):
+    """
+    Hash of the exact text an embedding is computed from and the model computing it
+    """
+    return hashlib.sha256("{}\x00{}".format(model_id, text).encode("utf-8")).hexdigest()
+
+
+def embedding_action(digest, stored_hash, has_vector, reembed_existing=False):
+    """
+    What a document whose text hashes to `digest` needs: "unchanged" when its
+    vector was computed from that text, "adopt" when it has a vector from
+    before hashes were recorded (only the hash is written), otherwise "embed"
+    """
+    if has_vector and stored_hash == digest:
+        return "unchanged"
+    if has_vector and stored_hash is None and not reembed_existing:
+        return "adopt"
+    return "embed"
+
+
+class Throttled(Exception):
+    """Raised by an embedder when the embedding service throttles a request."""
+
+
+def is_throttle(error):
+    if isinstance(error, Throttled):
+        return True
+    return getattr(error, "response", {}).get("Error", {}).get("Code") in THROTTLE_CODES
+
+
+class TitanEmbedder:
+    """
+    Embeds texts one request at a time with a Titan text embedding model
+    """
+
+    def __init__(self, bedrock_runtime, model_id=TITAN_MODEL_ID):
+        self.bedrock_runtime = bedrock_runtime
+        self.model_id = model_id
+
+    def __call__(self, texts):
+        return [embed_titan(self.bedrock_runtime, text, self.model_id) for text in texts]
+
+
+class StubEmbedder:
+    """
+    Deterministic pseudo-embeddings for running without Bedrock: identical
+    texts get identical vectors. `latency_ms` and `throttle_rate` simulate
+    the service's response time and throttling
+    """
+
+    model_id = "stub"
+
+    def __init__(self, dim=1536, latency_ms=0, throttle_rate=0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+
+    def __call__(self, texts):
+        import numpy as np
+
+        time.sleep(self.latency_ms * len(texts) / 1000)
+        if random.random() < self.throttle_rate:
+            raise Throttled("stub throttling")
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vectors.append(np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist())
+        return vectors
+
+
+class AdaptiveBackoff:
+    """
+    Pacing shared by every embedding worker. A throttled call doubles the
+    delay each worker waits before its next call, up to `max_delay`
+    seconds; every successful call shrinks it again, so the workers settle
+    just below the rate the service accepts
+    """
+
+    def __init__(self, base_delay=0.5, max_delay=20.0, decay=0.8):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.decay = decay
+        self.delay = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self.delay
+        if delay:
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.delay = min(max(self.delay * 2, self.base_delay), self.max_delay)
+
+    def on_success(self):
+        with self._lock:
+            self.delay = self.delay * self.decay if self.delay * self.decay >= self.base_delay / 8 else 0.0
+
+    def call(self, embed, texts, max_retries=8):
+        """
+        `embed(texts)`, retried after a backoff while it is throttled
+        """
+        for attempt in range(max_retries + 1):
+            self.wait()
+            try:
+                vectors = embed(texts)
+            except Exception as e:
+                if not is_throttle(e) or attempt == max_retries:
+                    raise
+                self.on_throttle()
+                continue
+            self.on_success()
+            return vectors
+
+
+class EmbeddingBackfill:
+    """
+    Computes the embedding of `source_field` for the documents that have none
+    or whose text changed since it was computed.
+
+    Every embedded document stores the content hash of (model id, text) in
+    `hash_field`, so a re-run skips the documents whose hash still matches.
+    Documents that already have a vector but no hash (e.g. imported from the
+    CSV) only get the hash recorded, unless `reembed_existing`. Identical
+    texts are embedded once: within a batch, while their batch is in flight
+    and through a bounded cache of recent vectors. Distinct texts are
+    embedded `batch_size` at a time on `workers` threads through `embed`, any
+    callable mapping a list of texts to a list of vectors, and throttled
+    calls back off adaptively. Vectors are written back with unordered
+    bulk writes that only match a document if its text is still the one
+    embedded.
+    """
+
+    def __init__(self, collection, embed, model_id, source_field="About Place", vector_field="details_embedding",
+                 hash_field=None, vector_encoding="array", workers=4, batch_size=8, write_batch=500,
+                 reembed_existing=False, dedup_cache=10000, backoff=None):
+        self.collection = collection
+        self.embed = embed
+        self.model_id = model_id
+        self.source_field = source_field
+        self.vector_field = vector_field
+        self.hash_field = hash_field or content_hash_field(vector_field)
+        self.vector_encoding = vector_encoding
+        self.workers = workers
+        self.batch_size = batch_size
+        self.write_batch = write_batch
+        self.reembed_existing = reembed_existing
+        self.dedup_cache = dedup_cache
+        self.backoff = backoff or AdaptiveBackoff()
+        self._recent = OrderedDict()
+        self._requests = []
+        self._counters = {"scanned": 0, "unchanged": 0, "adopted": 0, "embedded": 0, "deduplicated": 0,
+                          "written": 0}
+        self._started = None
+
+    def _missing_vectors(self):
+        return {doc["_id"] for doc in self.collection.find(
+            {self.source_field: {"$exists": True}, self.vector_field: {"$exists": False}}, {"_id": 1})}
+
+    def _documents(self):
+        return self.collection.find({self.source_field: {"$exists": True}},
+                                    {self.source_field: 1, self.hash_field: 1}, batch_size=self.write_batch)
+
+    def _update(self, _id, text, fields):
+        from pymongo import UpdateOne
+
+        # Matching on the text as well leaves a document edited meanwhile to the next run
+        self._requests.append(UpdateOne({"_id": _id, self.source_field: text}, {"$set": fields}))
+        if len(self._requests) >= self.write_batch:
+            self._flush()
+
+    def _flush(self):
+        if not self._requests:
+            return
+        result = self.collection.bulk_write(self._requests, ordered=False)
+        self._counters["written"] += result.modified_count
+        self._requests = []
+        elapsed = time.perf_counter() - self._started
+        logger.info(f"Scanned {self._counters['scanned']} documents, embedded {self._counters['embedded']} texts "
+                    f"({self._counters['scanned'] / elapsed:.0f} docs/sec)")
+
+    def _remember(self, digest, vector):
+        self._recent[digest] = vector
+        while len(self._recent) > self.dedup_cache:
+            self._recent.popitem(last=False)
+
+    def _store(self, digest, text, ids, vector):
+        fields = {self.vector_field: encode_vector(vector, self.vector_encoding), self.hash_field: digest}
+        for _id in ids:
+            self._update(_id, text, fields)
+
+    def _collect(self, future, batch, in_flight):
+        for (digest, text, ids), vector in zip(batch, future.result()):
+            del in_flight[digest]
+            self._remember(digest, vector)
+            self._store(digest, text, ids, vector)
+
+    def run(self, dry_run=False):
+        """
+        Backfill the collection, returns the stats of the run
+        """
+        self._started = time.perf_counter()
+        counters = self._counters
+        missing = self._missing_vectors()
+        pending, in_flight, futures, seen = {}, {}, deque(), set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def submit():
+                batch = [(digest, text, ids) for digest, (text, ids) in pending.items()]
+                in_flight.update((digest, ids) for digest, _, ids in batch)
+                pending.clear()
+                futures.append((pool.submit(self.backoff.call, self.embed, [text for _, text, _ in batch]), batch))
+                counters["embedded"] += len(batch)
+                while len(futures) >= self.workers * 2:
+                    self._collect(*futures.popleft(), in_flight)
+
+            for doc in self._documents():
+                counters["scanned"] += 1
+                text = doc[self.source_field]
+                if not isinstance(text, str) or not text.strip():
+                    continue
+                digest = content_hash(self.model_id, text)
+                action = embedding_action(digest, doc.get(self.hash_field), doc["_id"] not in missing,
+                                          self.reembed_existing)
+                if action == "unchanged":
+                    counters["unchanged"] += 1
+                elif action == "adopt":
+                    counters["adopted"] += 1
+                    if not dry_run:
+                        self._update(doc["_id"], text, {self.hash_field: digest})
+                elif dry_run:
+                    counters["embedded" if digest not in seen else "deduplicated"] += 1
+                    seen.add(digest)
+                elif digest in self._recent:
+                    counters["deduplicated"] += 1
+                    self._recent.move_to_end(digest)
+                    self._store(digest, text, [doc["_id"]], self._recent[digest])
+                elif digest in in_flight or digest in pending:
+                    counters["deduplicated"] += 1
+                    (in_flight.get(digest) or pending[digest][1]).append(doc["_id"])
+                else:
+                    pending[digest] = (text, [doc["_id"]])
+                    if len(pending) >= self.batch_size:
+                        submit()
+
+            if pending:
+                submit()
+            while futures:
+                self._collect(*futures.popleft(), in_flight)
+        self._flush()
+        return self.stats()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            **self._counters,
+            "throttled": self.backoff.throttled,
+            "seconds": round(elapsed, 1),
+            "docs_per_sec": round(self._counters["scanned"] / elapsed, 1) if elapsed else 0.0,
+        }
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+TITAN_MODEL_ID = "amazon.titan-embed-text-v1"
+
+
+def embed_titan(bedrock_runtime, text, model_id=TITAN_MODEL_ID):
+    """
+    Embed a single text with a Titan text embedding model
+    """
+    response = bedrock_runtime.invoke_model(
+        modelId=model_id,
+        body=json.dumps({"inputText": text}),
+        contentType="application/json",
+        accept="application/json"
+    )
+    return json.loads(response['body'].read()).get("embedding")
+
+
+def normalize_text(text):
+    """
+    Normalize a query for cache lookups: trim, collapse whitespace and case-fold
+    """
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(model_id, text):
+    return hashlib.sha256("{}\x00{}".format(model_id, normalize_text(text)).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings.
+
+    The first tier is an in-process LRU bounded by `max_entries` and `ttl`
+    seconds, so warm containers never call Bedrock for a repeated query.
+    It holds the vectors as float32 arrays (6 KB for 1536 dimensions rather
+    than about 48 KB as a list of floats) and returns them as lists. The
+    optional second tier is a MongoDB collection shared by every container,
+    keyed by a hash of (model id, normalized text) and expired by a TTL index
+    on `created_at`. Errors in the shared tier are logged and treated as a miss.
+    """
+
+    def __init__(self, max_entries=1024, ttl=86400, get_collection=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._get_collection = get_collection
+        self._shared_ready = False
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "miss_ms": 0.0,
+            "shared_lookup_ms": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls, get_client=None):
+        """
+        Build a cache from EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL and
+        EMBEDDING_CACHE_COLLECTION ("<db>.<collection>", enables the shared tier)
+        """
+        get_collection = None
+        namespace = os.environ.get("EMBEDDING_CACHE_COLLECTION")
+        if namespace and get_client is not None:
+            db_name, collection_name = namespace.split(".", 1)
+            get_collection = lambda: get_client()[db_name][collection_name]
+        return cls(
+            max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", "1024")),
+            ttl=int(os.environ.get("EMBEDDING_CACHE_TTL", "86400")),
+            get_collection=get_collection,
+        )
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return vector.tolist()
+
+    def _memory_put(self, key, vector):
+        with self._lock:
+            self._entries[key] = (array("f", vector), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _shared_collection(self):
+        if self._get_collection is None:
+            return None
+        collection = self._get_collection()
+        if not self._shared_ready:
+            collection.create_index("created_at", expireAfterSeconds=self.ttl)
+            self._shared_ready = True
+        return collection
+
+    def _shared_get(self, key):
+        from pymongo.errors import PyMongoError
+
+        try:
+            collection = self._shared_collection()
+            if collection is None:
+                return None
+            start = time.perf_counter()
+            doc = collection.find_one({"_id": key}, {"embedding": 1})
+            self._counters["shared_lookup_ms"] += (time.perf_counter() - start) * 1000
+        except PyMongoError as e:
+            logger.warning(f"Shared embedding cache lookup failed: {e}")
+            return None
+        return doc["embedding"] if doc else None
+
+    def _shared_put(self, key, model_id, vector):
+        from pymongo.errors import PyMongoError
+
+        try:
+            collection = self._shared_collection()
+            if collection is None:
+                return
+            collection.replace_one(
+                {"_id": key},
+                {"model_id": model_id, "embedding": vector, "created_at": datetime.now(timezone.utc)},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            logger.warning(f"Shared embedding cache write failed: {e}")
+
+    def get(self, model_id, text, compute):
+        """
+        Return the embedding of `text`, calling `compute(text)` only on a miss in both tiers
+        """
+        key = cache_key(model_id, text)
+        vector = self._memory_get(key)
+        if vector is not None:
+            self._counters["memory_hits"] += 1
+            return vector
+
+        vector = self._shared_get(key)
+        if vector is not None:
+            self._counters["shared_hits"] += 1
+            self._memory_put(key, vector)
+            return vector
+
+        start = time.perf_counter()
+        vector = compute(text)
+        self._counters["miss_ms"] += (time.perf_counter() - start) * 1000
+        self._counters["misses"] += 1
+        if vector:
+            self._memory_put(key, vector)
+            self._shared_put(key, model_id, vector)
+        return vector
+
+    def stats(self):
+        """
+        Hit rates plus an estimate of the Bedrock time saved, based on the
+        average latency of the misses seen by this container
+        """
+        counters = self._counters
+        hits = counters["memory_hits"] + counters["shared_hits"]
+        lookups = hits + counters["misses"]
+        avg_miss_ms = counters["miss_ms"] / counters["misses"] if counters["misses"] else 0.0
+        saved_ms = hits * avg_miss_ms - counters["shared_lookup_ms"]
+        return {
+            "entries": len(self._entries),
+            "memory_hits": counters["memory_hits"],
+            "shared_hits": counters["shared_hits"],
+            "misses": counters["misses"],
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "avg_miss_ms": round(avg_miss_ms, 1),
+            "saved_ms": round(max(saved_ms, 0.0), 1),
+        }
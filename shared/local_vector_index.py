@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from serializer import dumps
+
+logger = logging.getLogger(__name__)
+
+# A snapshot is a directory holding the L2-normalized embeddings as one float32
+# .npy matrix (memory-mapped on load, so opening it costs no copy), the projected
+# fields of each document in the same order, optionally an HNSW graph, and
+# meta.json, written last, which marks the snapshot complete
+SNAPSHOT_VECTORS = "vectors.npy"
+SNAPSHOT_DOCS = "docs.json"
+SNAPSHOT_GRAPH = "hnsw.bin"
+SNAPSHOT_META = "meta.json"
+
+# Rows scored per matrix-vector product by the exact scan
+SCAN_BLOCK_ROWS = 65536
+
+
+def snapshot_version(collection):
+    """
+    Cheap version stamp of a collection: document count and newest _id
+    """
+    newest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return [collection.estimated_document_count(), str(newest["_id"]) if newest else None]
+
+
+def _replace(path, write, mode="w"):
+    """
+    Write a snapshot file through a temporary file, so readers never see a partial one
+    """
+    tmp = path + ".tmp"
+    with open(tmp, mode) as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def build_snapshot(collection, vector_field, fields, path, ann=False, batch_size=1000):
+    """
+    Write the embeddings in `vector_field` and the `fields` of every document
+    of `collection` to the snapshot directory `path`. With `ann`, also build
+    an HNSW graph (needs hnswlib). Returns the number of vectors written
+    """
+    import numpy as np
+
+    from vector_codec import decode_vector
+
+    start = time.perf_counter()
+    version = snapshot_version(collection)
+    projection = {"_id": 0, vector_field: 1, **{field: 1 for field in fields}}
+    vectors, docs = [], []
+    for doc in collection.find({vector_field: {"$exists": True}}, projection, batch_size=batch_size):
+        vectors.append(decode_vector(doc.pop(vector_field)))
+        docs.append(doc)
+
+    matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1, norms)
+
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, SNAPSHOT_META)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    _replace(os.path.join(path, SNAPSHOT_VECTORS), lambda f: np.save(f, matrix), mode="wb")
+    _replace(os.path.join(path, SNAPSHOT_DOCS), lambda f: f.write(dumps(docs)))
+
+    graph_path = os.path.join(path, SNAPSHOT_GRAPH)
+    if ann and len(docs):
+        import hnswlib
+
+        graph = hnswlib.Index(space="cosine", dim=matrix.shape[1])
+        graph.init_index(max_elements=len(docs), ef_construction=200, M=16)
+        graph.add_items(matrix, np.arange(len(docs)))
+        graph.save_index(graph_path + ".tmp")
+        os.replace(graph_path + ".tmp", graph_path)
+    elif os.path.exists(graph_path):
+        os.remove(graph_path)
+
+    meta = {
+        "vector_field": vector_field,
+        "fields": list(fields),
+        "count": len(docs),
+        "dim": int(matrix.shape[1]),
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    _replace(meta_path, lambda f: json.dump(meta, f))
+    logger.info(f"Wrote a snapshot of {len(docs)} vectors to {path} in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return len(docs)
+
+
+class LocalVectorIndex:
+    """
+    In-process vector search over a snapshot of a small collection.
+
+    Queries are answered with an exact cosine top-k over the memory-mapped
+    embedding matrix, scanned in blocks, or with the snapshot's HNSW graph
+    when it has one and hnswlib is installed (`ann="exact"` disables it,
+    `ann="hnsw"` also builds the graph when the snapshot is rebuilt).
+    Results have the shape of a $vectorSearch stage projecting `fields` and
+    the vectorSearchScore of a cosine index, (1 + cosine) / 2.
+
+    Every `ttl` seconds refresh() compares the collection's version stamp
+    with the snapshot's and rebuilds the snapshot when they differ, or when
+    it is older than `max_age` seconds, since the stamp misses in-place
+    updates such as re-embedded texts (0 disables the forced rebuild). With a
+    `ttl` of 0 an existing snapshot is used as is, e.g. one shipped with the
+    function. Snapshots are only written to `build_path`, `path` itself when
+    it is under the temporary directory (the only writable one on Lambda),
+    otherwise a directory of the same name there; the newer of the two is
+    loaded. refresh(build=False) never builds, so a missing snapshot can be
+    left to init instead of a request.
+    """
+
+    def __init__(self, path, vector_field, fields, ttl=300, ann="auto", max_age=3600, build_path=None):
+        self.path = path
+        self.build_path = build_path or self._default_build_path(path)
+        self.vector_field = vector_field
+        self.fields = list(fields)
+        self.ttl = ttl
+        self.max_age = max_age
+        self.ann = ann
+        self._vectors = None
+        self._docs = []
+        self._graph = None
+        self._version = None
+        self._created_at = None
+        self._checked_at = 0.0
+
+    @classmethod
+    def from_env(cls, vector_field, fields):
+        """
+        Build an index on the snapshot directory LOCAL_VECTOR_INDEX, None when
+        unset, refreshed every LOCAL_VECTOR_INDEX_TTL seconds and rebuilt at
+        least every LOCAL_VECTOR_INDEX_MAX_AGE seconds
+        """
+        path = os.environ.get("LOCAL_VECTOR_INDEX")
+        if not path:
+            return None
+        return cls(
+            path, vector_field, fields,
+            ttl=int(os.environ.get("LOCAL_VECTOR_INDEX_TTL", "300")),
+            ann=os.environ.get("LOCAL_VECTOR_ANN", "auto"),
+            max_age=int(os.environ.get("LOCAL_VECTOR_INDEX_MAX_AGE", "3600")),
+        )
+
+    def __len__(self):
+        return len(self._docs)
+
+    def is_stale(self):
+        return self._vectors is None or (self.ttl > 0 and time.monotonic() - self._checked_at >= self.ttl)
+
+    def _expired(self):
+        age = (datetime.now(timezone.utc) - self._created_at).total_seconds()
+        return self.max_age > 0 and age >= self.max_age
+
+    @staticmethod
+    def _default_build_path(path):
+        tmp = os.path.realpath(tempfile.gettempdir())
+        if os.path.realpath(path).startswith(tmp + os.sep):
+            return path
+        return os.path.join(tmp, os.path.basename(os.path.normpath(path)) or "vector_snapshot")
+
+    def ready(self):
+        return self._vectors is not None
+
+    def _newest_snapshot(self):
+        """
+        The directory holding the newest complete snapshot of these fields, None when there is none
+        """
+        newest, newest_created = None, ""
+        for path in dict.fromkeys([self.build_path, self.path]):
+            try:
+                with open(os.path.join(path, SNAPSHOT_META)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if meta["vector_field"] == self.vector_field and meta["fields"] == self.fields \
+                    and meta["created_at"] > newest_created:
+                newest, newest_created = path, meta["created_at"]
+        return newest
+
+    def load(self, path=None):
+        import numpy as np
+
+        path = path or self.path
+        start = time.perf_counter()
+        with open(os.path.join(path, SNAPSHOT_META)) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, SNAPSHOT_DOCS)) as f:
+            docs = json.load(f)
+        vectors = np.load(os.path.join(path, SNAPSHOT_VECTORS), mmap_mode="r")
+
+        graph = None
+        graph_path = os.path.join(path, SNAPSHOT_GRAPH)
+        if self.ann != "exact" and os.path.exists(graph_path):
+            try:
+                import hnswlib
+            except ImportError:
+                logger.warning("Snapshot has an HNSW graph but hnswlib is not installed, using the exact scan")
+            else:
+                graph = hnswlib.Index(space="cosine", dim=meta["dim"])
+                graph.load_index(graph_path, max_elements=meta["count"])
+
+        self._vectors, self._docs, self._graph, self._version = vectors, docs, graph, meta["version"]
+        self._created_at = datetime.fromisoformat(meta["created_at"])
+        logger.info(f"Loaded {len(docs)} vectors ({'hnsw' if graph else 'exact'}) "
+                    f"in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def refresh(self, collection, build=True):
+        """
+        Load the newest snapshot and, with `build`, rebuild it into
+        `build_path` first if it is missing, too old or the collection changed
+        """
+        if not self.is_stale():
+            return
+        if self._vectors is None:
+            path = self._newest_snapshot()
+            if path:
+                self.load(path)
+        if build and (self._vectors is None or self.ttl > 0):
+            if self._vectors is None or self._expired() or snapshot_version(collection) != self._version:
+                ann = self.ann == "hnsw" or (self.ann == "auto" and self._graph is not None)
+                build_snapshot(collection, self.vector_field, self.fields, self.build_path, ann=ann)
+                self.load(self.build_path)
+        self._checked_at = time.monotonic()
+
+    def _exact(self, query, limit):
+        import numpy as np
+
+        best_scores, best_rows = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        for start in range(0, len(self._vectors), SCAN_BLOCK_ROWS):
+            scores = self._vectors[start:start + SCAN_BLOCK_ROWS] @ query
+            if len(scores) > limit:
+                top = np.argpartition(scores, -limit)[-limit:]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+        order = np.argsort(-best_scores)[:limit]
+        return best_rows[order], best_scores[order]
+
+    def _approximate(self, query, limit, num_candidates):
+        self._graph.set_ef(max(num_candidates or 0, limit))
+        rows, distances = self._graph.knn_query(query, k=limit)
+        return rows[0], 1.0 - distances[0]
+
+    def search(self, vector, limit, num_candidates=None, with_vectors=False):
+        """
+        Top `limit` documents by cosine similarity to `vector`.
+        `num_candidates` sets the HNSW search breadth, like numCandidates;
+        `with_vectors` adds each one's (normalized) embedding in `vector_field`
+        """
+        import numpy as np
+
+        if self._vectors is None or not len(self._docs):
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        limit = min(limit, len(self._docs))
+        if self._graph is not None:
+            rows, similarities = self._approximate(query, limit, num_candidates)
+        else:
+            rows, similarities = self._exact(query, limit)
+        docs = [{**self._docs[row], "score": (1.0 + float(similarity)) / 2}
+                for row, similarity in zip(rows, similarities)]
+        if with_vectors:
+            for doc, row in zip(docs, rows):
+                doc[self.vector_field] = self._vectors[row]
+        return docs
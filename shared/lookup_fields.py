@@ -0,0 +1,147 @@
+import calendar
+import re
+import unicodedata
+
+# Source field -> normalized copy used by the place lookups
+LOOKUP_FIELDS = {
+    "Place Name": "place_name_norm",
+    "Country": "country_norm",
+}
+
+# Month names listed or spanned by "Best Time To Visit", used by the vector search filters
+BEST_MONTHS_SOURCE = "Best Time To Visit"
+BEST_MONTHS_FIELD = "best_months"
+
+# Every field derived from the source fields at import
+DERIVED_FIELDS = [*LOOKUP_FIELDS.values(), BEST_MONTHS_FIELD]
+
+
+def content_hash_field(vector_field):
+    """
+    Field holding the content hash of the text a vector was computed from
+    """
+    return f"{vector_field}_hash"
+
+
+MONTHS = list(calendar.month_name)[1:]
+# Full month names and their usual abbreviations -> month number (0-based)
+_MONTH_NUMBERS = {
+    **{name.casefold(): number for number, name in enumerate(MONTHS)},
+    **{name.casefold()[:3]: number for number, name in enumerate(MONTHS)},
+    "sept": 8,
+}
+# Full names match in any case; abbreviations and "May" only capitalized, as
+# "may" and "mar" are also ordinary words
+_LOOSE_MONTHS = [name.casefold() for name in MONTHS if name != "May"]
+_STRICT_MONTHS = [spelling for name in _MONTH_NUMBERS if name not in _LOOSE_MONTHS
+                  for spelling in (name.title(), name.upper())]
+_MONTH_PATTERN = re.compile(
+    r"\b((?i:" + "|".join(sorted(_LOOSE_MONTHS, key=len, reverse=True)) + r")|"
+    + "|".join(sorted(_STRICT_MONTHS, key=len, reverse=True)) + r")\b\.?")
+_RANGE_PATTERN = re.compile(r"^\s*(?:to|through|till|until|-|\u2013|\u2014)\s*$", re.IGNORECASE)
+# "and" only spans months after "between", e.g. "between March and May"
+_BETWEEN_PATTERN = re.compile(r"\bbetween\b[^,;.]*$", re.IGNORECASE)
+_AND_PATTERN = re.compile(r"^\s*and\s*$", re.IGNORECASE)
+_ALL_YEAR_PATTERN = re.compile(r"year[\s-]*round|all[\s-]+year|any\s*time|throughout the year", re.IGNORECASE)
+
+
+def normalize_lookup(text):
+    """
+    Lower-case, strip accents and collapse whitespace, e.g. "  Hội An " -> "hoi an"
+    """
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+def month_name(text):
+    """
+    Full month name of "March", "mar" or "3", None when it is not a month
+    """
+    text = str(text).strip()
+    if text.isdigit():
+        return MONTHS[int(text) - 1] if 1 <= int(text) <= 12 else None
+    number = _MONTH_NUMBERS.get(text.casefold().rstrip("."))
+    return MONTHS[number] if number is not None else None
+
+
+def _spans(text, previous_end, match, following):
+    connector = text[match.end():following.start()]
+    return bool(_RANGE_PATTERN.match(connector) or (
+        _AND_PATTERN.match(connector) and _BETWEEN_PATTERN.search(text[previous_end:match.start()])))
+
+
+def best_months(text):
+    """
+    Months named or spanned by a free-text period, in calendar order, e.g.
+    "November to March" -> [January, February, March, November, December],
+    "April-May, September" -> [April, May, September] and "between March
+    and May" -> [March, April, May]
+    """
+    if not text:
+        return []
+    if _ALL_YEAR_PATTERN.search(str(text)):
+        return list(MONTHS)
+    matches = list(_MONTH_PATTERN.finditer(str(text)))
+    numbers = set()
+    for i, match in enumerate(matches):
+        start = _MONTH_NUMBERS[match.group(1).casefold()]
+        numbers.add(start)
+        if i + 1 < len(matches) and _spans(text, matches[i - 1].end() if i else 0, match, matches[i + 1]):
+            end = _MONTH_NUMBERS[matches[i + 1].group(1).casefold()]
+            numbers.update((start + step) % 12 for step in range((end - start) % 12 + 1))
+    return [MONTHS[number] for number in sorted(numbers)]
+
+
+def add_lookup_fields(doc):
+    """
+    Set the normalized lookup fields and the best months of a document from its source fields
+    """
+    for source, target in LOOKUP_FIELDS.items():
+        if doc.get(source) is not None:
+            doc[target] = normalize_lookup(doc[source])
+    if doc.get(BEST_MONTHS_SOURCE) is not None:
+        doc[BEST_MONTHS_FIELD] = best_months(doc[BEST_MONTHS_SOURCE])
+    return doc
+
+
+def exact_filter(text, sources):
+    value = normalize_lookup(text)
+    return {"$or": [{LOOKUP_FIELDS[source]: value} for source in sources]}
+
+
+def prefix_filter(text, sources):
+    """
+    Anchored, case-sensitive regex on the normalized fields, which the
+    server answers with an index range scan
+    """
+    pattern = "^" + re.escape(normalize_lookup(text))
+    return {"$or": [{LOOKUP_FIELDS[source]: {"$regex": pattern}} for source in sources]}
+
+
+def ensure_lookup_indexes(collection, batch_size=500):
+    """
+    Create the lookup indexes and fill in the derived fields of documents
+    imported before they existed. Safe to run any number of times
+    """
+    from pymongo import UpdateOne
+
+    for target in LOOKUP_FIELDS.values():
+        collection.create_index(target, name=target)
+
+    sources = [*LOOKUP_FIELDS, BEST_MONTHS_SOURCE]
+    missing = {"$or": [{target: {"$exists": False}} for target in DERIVED_FIELDS]}
+    projection = {source: 1 for source in sources}
+    requests = []
+    updated = 0
+    for doc in collection.find(missing, projection, batch_size=batch_size):
+        fields = add_lookup_fields({source: doc.get(source) for source in sources})
+        fields = {target: fields[target] for target in DERIVED_FIELDS if target in fields}
+        if fields:
+            requests.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(requests) >= batch_size:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += collection.bulk_write(requests, ordered=False).modified_count
+    return updated
@@ -0,0 +1,52 @@
+import json
+import logging
+import math
+import os
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Written by tune_num_candidates.py and shipped with the shared layer, one entry
+# per "<db>.<collection>" with the smallest numCandidates reaching the target
+# recall for each tuned limit, e.g.
+# {"travel.asia": {"index": "travel_vector_index", "numCandidates": {"10": 120}, ...}}
+VECTOR_SEARCH_SETTINGS = os.environ.get(
+    "VECTOR_SEARCH_SETTINGS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_search_settings.json"))
+
+# Upper bound accepted by $vectorSearch
+MAX_NUM_CANDIDATES = 10000
+
+
+@lru_cache(maxsize=None)
+def load_settings(path=VECTOR_SEARCH_SETTINGS):
+    """
+    Read the tuned settings once per container, {} when there are none
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring vector search settings {path}: {e}")
+        return {}
+
+
+def num_candidates(namespace, limit, default):
+    """
+    numCandidates for a $vectorSearch returning `limit` documents from
+    `namespace`: the tuned value of the smallest tuned limit covering it,
+    scaled up for limits above every tuned one, or `default` when the
+    collection was never tuned
+    """
+    tuned = load_settings().get(namespace, {}).get("numCandidates")
+    if not tuned:
+        return default
+    limits = sorted(int(k) for k in tuned)
+    covering = [k for k in limits if k >= limit]
+    if covering:
+        candidates = tuned[str(covering[0])]
+    else:
+        largest = limits[-1]
+        candidates = math.ceil(tuned[str(largest)] / largest * limit)
+    return min(max(candidates, limit), MAX_NUM_CANDIDATES)
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Cache of vector search results keyed by the query embedding.
+
+    A query whose embedding has a cosine similarity of at least `threshold`
+    with a cached query of the same `scope` (index, limit, filters...) gets
+    that query's results without a database round-trip. The normalized
+    embeddings of at most `max_entries` recent queries are kept in one NumPy
+    matrix, so a lookup is a single matrix-vector product. Entries expire after
+    `ttl` seconds and the least recently used one is evicted when the cache is
+    full. NumPy is imported on first use.
+    """
+
+    def __init__(self, max_entries=256, ttl=300, threshold=0.97):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._size = 0
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "hit_similarity": 0.0,
+            "miss_ms": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a cache from SEMANTIC_CACHE_SIZE (0 disables it),
+        SEMANTIC_CACHE_TTL and SEMANTIC_CACHE_THRESHOLD
+        """
+        return cls(
+            max_entries=int(os.environ.get("SEMANTIC_CACHE_SIZE", "256")),
+            ttl=int(os.environ.get("SEMANTIC_CACHE_TTL", "300")),
+            threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.97")),
+        )
+
+    def _allocate(self, dim):
+        import numpy as np
+
+        self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._scopes = np.zeros(self.max_entries, dtype=np.int64)
+        self._stored_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._used_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._results = [None] * self.max_entries
+        self._size = 0
+
+    def _lookup(self, query, scope_hash, now):
+        import numpy as np
+
+        n = self._size
+        if n == 0:
+            return None, 0.0
+        similarities = self._vectors[:n] @ query
+        valid = (self._scopes[:n] == scope_hash) & (now - self._stored_at[:n] <= self.ttl)
+        similarities = np.where(valid, similarities, -np.inf)
+        slot = int(np.argmax(similarities))
+        similarity = float(similarities[slot])
+        if similarity < self.threshold:
+            return None, similarity
+        self._used_at[slot] = now
+        return slot, similarity
+
+    def _store(self, query, scope_hash, results, now):
+        import numpy as np
+
+        if self._size < self.max_entries:
+            slot = self._size
+            self._size += 1
+        else:
+            # Expired entries go first, then the least recently used
+            expired = now - self._stored_at > self.ttl
+            slot = int(np.argmin(np.where(expired, -np.inf, self._used_at)))
+        self._vectors[slot] = query
+        self._scopes[slot] = scope_hash
+        self._stored_at[slot] = now
+        self._used_at[slot] = now
+        self._results[slot] = results
+
+    def get(self, vector, compute, scope=None):
+        """
+        Return the results for the query embedding `vector`, calling
+        `compute(vector)` only when no similar enough query of the same scope
+        is cached
+        """
+        if self.max_entries <= 0 or vector is None or len(vector) == 0:
+            return compute(vector)
+
+        import numpy as np
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0:
+            return compute(vector)
+        query = query / norm
+        scope_hash = hash(scope)
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                if self._vectors is not None:
+                    logger.warning(f"Query embedding size changed to {query.shape[0]}, clearing the semantic cache")
+                self._allocate(query.shape[0])
+            slot, similarity = self._lookup(query, scope_hash, time.monotonic())
+            if slot is not None:
+                self._counters["hits"] += 1
+                self._counters["hit_similarity"] += similarity
+                return self._results[slot]
+
+        start = time.perf_counter()
+        results = compute(vector)
+        self._counters["miss_ms"] += (time.perf_counter() - start) * 1000
+        self._counters["misses"] += 1
+        with self._lock:
+            if self._vectors.shape[1] == query.shape[0]:
+                self._store(query, scope_hash, results, time.monotonic())
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            if self._vectors is not None:
+                self._results = [None] * self.max_entries
+
+    def stats(self):
+        """
+        Hit rate, mean similarity of the hits and an estimate of the query
+        time saved, based on the average latency of the misses
+        """
+        counters = self._counters
+        lookups = counters["hits"] + counters["misses"]
+        avg_miss_ms = counters["miss_ms"] / counters["misses"] if counters["misses"] else 0.0
+        return {
+            "entries": self._size,
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": round(counters["hits"] / lookups, 3) if lookups else 0.0,
+            "avg_hit_similarity": round(counters["hit_similarity"] / counters["hits"], 4) if counters["hits"] else 0.0,
+            "saved_ms": round(counters["hits"] * avg_miss_ms, 1),
+        }
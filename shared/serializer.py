@@ -0,0 +1,70 @@
+import base64
+import datetime
+import decimal
+import uuid
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the standard library encoder
+    orjson = None
+    import json
+
+
+def _default(value):
+    """
+    Encode the BSON types returned by pymongo that JSON has no type for
+    """
+    from bson import Binary, Decimal128, ObjectId
+
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Binary) and value.subtype == 9:
+        return value.as_vector().data
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    # Any other BSON type (Timestamp, Regex, DBRef, MinKey/MaxKey, Code) as Extended JSON
+    from bson import json_util
+
+    try:
+        return json_util.default(value)
+    except TypeError:
+        return str(value)
+
+
+def _shrink(value, fields, max_items, max_string):
+    if isinstance(value, dict):
+        items = value.items() if fields is None else ((k, v) for k, v in value.items() if k in fields)
+        return {k: _shrink(v, None, max_items, max_string) for k, v in items}
+    if isinstance(value, (list, tuple)):
+        if max_items is not None and len(value) > max_items:
+            value = value[:max_items]
+        return [_shrink(v, fields, max_items, max_string) for v in value]
+    if isinstance(value, str) and max_string is not None and len(value) > max_string:
+        return value[:max_string] + "..."
+    return value
+
+
+def dumps(value, fields=None, max_items=None, max_string=None):
+    """
+    Serialize query results to compact JSON.
+
+    `fields` keeps only those keys of the top-level documents (of a single
+    document or of each document in a list), `max_items` truncates lists
+    and `max_string` truncates long strings. Without any of these the value
+    goes straight to the encoder.
+    """
+    if fields is not None or max_items is not None or max_string is not None:
+        value = _shrink(value, set(fields) if fields is not None else None, max_items, max_string)
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, default=_default, separators=(",", ":"), ensure_ascii=False)
@@ -0,0 +1,144 @@
+import functools
+import json
+import os
+import threading
+import time
+
+# Time the stages of each invocation (secret, embedding, query, cursor, rerank, format)
+# and emit them as CloudWatch embedded metric format (EMF) records, one per stage,
+# plus an X-Ray subsegment per stage when a Powertools Tracer is attached.
+# Enabled with STAGE_METRICS=true. When disabled, stage() returns a shared
+# no-op context manager and fetch() is a plain list().
+STAGE_METRICS = os.environ.get("STAGE_METRICS", "false").lower() == "true"
+STAGE_METRICS_NAMESPACE = os.environ.get("POWERTOOLS_METRICS_NAMESPACE", "AtlasAgents")
+
+
+class _NoopStage:
+    __slots__ = ("count", "bytes")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+class _Stage:
+    """
+    One timed stage. Set `count` (results) and `bytes` (payload size) inside
+    the with block to report them alongside the duration
+    """
+
+    __slots__ = ("timer", "name", "count", "bytes", "_start", "_context", "_subsegment")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.count = None
+        self.bytes = None
+        self._context = None
+
+    def __enter__(self):
+        if self.timer.tracer is not None:
+            self._context = self.timer.tracer.provider.in_subsegment(f"## {self.name}")
+            self._subsegment = self._context.__enter__()
+            self._subsegment.put_annotation("stage", self.name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self._start) * 1000
+        self.timer._record(self.name, ms, self.count, self.bytes)
+        if self._context is not None:
+            self._subsegment.put_metadata("timing", {"ms": round(ms, 3), "count": self.count, "bytes": self.bytes})
+            self._context.__exit__(exc_type, exc, tb)
+        return False
+
+
+class StageTimer:
+    """
+    Collects per-stage timings of the current invocation and writes them as
+    EMF records on flush(), with `function` and `stage` as dimensions. A stage
+    entered several times in one invocation (e.g. two queries) is summed.
+    """
+
+    def __init__(self, function_name=None, namespace=STAGE_METRICS_NAMESPACE, enabled=STAGE_METRICS, tracer=None):
+        self.function_name = function_name or os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+        self.namespace = namespace
+        self.enabled = enabled
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def stage(self, name):
+        """Context manager timing the stage `name`"""
+        if not self.enabled:
+            return _NOOP_STAGE
+        return _Stage(self, name)
+
+    def fetch(self, open_cursor, query="query", cursor="cursor"):
+        """
+        Return list(open_cursor()), timing the round-trip up to the first
+        document as `query` and draining the remaining batches as `cursor`
+        """
+        if not self.enabled:
+            return list(open_cursor())
+        with self.stage(query):
+            results = open_cursor()
+            first = next(results, None)
+        with self.stage(cursor) as stage:
+            docs = [] if first is None else [first, *results]
+            stage.count = len(docs)
+        return docs
+
+    def _record(self, name, ms, count, size):
+        with self._lock:
+            entry = self._stages.setdefault(name, {"ms": 0.0, "calls": 0, "count": None, "bytes": None})
+            entry["ms"] += ms
+            entry["calls"] += 1
+            if count is not None:
+                entry["count"] = (entry["count"] or 0) + count
+            if size is not None:
+                entry["bytes"] = (entry["bytes"] or 0) + size
+
+    def flush(self):
+        """Print one EMF record per stage timed since the last flush"""
+        with self._lock:
+            stages, self._stages = self._stages, {}
+        timestamp = int(time.time() * 1000)
+        for name, entry in stages.items():
+            metrics = [{"Name": "StageDuration", "Unit": "Milliseconds"}]
+            record = {"function": self.function_name, "stage": name, "calls": entry["calls"],
+                      "StageDuration": round(entry["ms"], 3)}
+            if entry["count"] is not None:
+                metrics.append({"Name": "ResultCount", "Unit": "Count"})
+                record["ResultCount"] = entry["count"]
+            if entry["bytes"] is not None:
+                metrics.append({"Name": "ResponseBytes", "Unit": "Bytes"})
+                record["ResponseBytes"] = entry["bytes"]
+            record["_aws"] = {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["function", "stage"]],
+                    "Metrics": metrics,
+                }],
+            }
+            print(json.dumps(record, separators=(",", ":")), flush=True)
+
+    def flush_after(self, handler):
+        """Decorate a Lambda handler to flush the stage metrics after every invocation"""
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            try:
+                return handler(event, context)
+            finally:
+                if self._stages:
+                    self.flush()
+        return wrapper
+
+
+timer = StageTimer()
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import random
+
+from serializer import dumps
+
+# Structured log lines with size-capped fields. Nothing is rendered for a level
+# that is not enabled, and a callable field value is only called when its line
+# is emitted. Strings longer than LOG_FIELD_MAX_CHARS are truncated, lists keep
+# LOG_FIELD_MAX_ITEMS items, and LOG_SAMPLE_RATE is the fraction of lines whose
+# fields are logged in full.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FIELD_MAX_CHARS = int(os.environ.get("LOG_FIELD_MAX_CHARS", "512"))
+LOG_FIELD_MAX_ITEMS = int(os.environ.get("LOG_FIELD_MAX_ITEMS", "5"))
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0"))
+
+
+def cap_field(value, max_chars=LOG_FIELD_MAX_CHARS, max_items=LOG_FIELD_MAX_ITEMS):
+    """
+    A field value as logged: scalars as they are, strings cut to `max_chars`,
+    documents and lists (with lists cut to `max_items`) nested when their
+    JSON fits in `max_chars`, otherwise that JSON cut with a note of how
+    much was left out
+    """
+    if callable(value):
+        value = value()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else dumps(value, max_items=max_items, max_string=max_chars)
+    if len(text) > max_chars:
+        return f"{text[:max_chars]}... [{len(text) - max_chars} more chars]"
+    return value if isinstance(value, str) else json.loads(text)
+
+
+class StructuredLog:
+    """
+    Logs a message with keyword fields as one JSON line on stdout, or
+    through `logger` (e.g. a Powertools Logger) as its extra keys
+    """
+
+    def __init__(self, name=None, logger=None, level=LOG_LEVEL, max_chars=LOG_FIELD_MAX_CHARS,
+                 max_items=LOG_FIELD_MAX_ITEMS, sample_rate=LOG_SAMPLE_RATE):
+        self.name = name
+        self.logger = logger
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+        self.max_chars = max_chars
+        self.max_items = max_items
+        self.sample_rate = sample_rate
+
+    def enabled(self, level):
+        if self.logger is not None:
+            return self.logger.isEnabledFor(level)
+        return level >= self.level
+
+    def fields(self, fields):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return {"sampled": True, **{key: value() if callable(value) else value for key, value in fields.items()}}
+        return {key: cap_field(value, self.max_chars, self.max_items) for key, value in fields.items()}
+
+    def log(self, level, message, **fields):
+        if not self.enabled(level):
+            return
+        fields = self.fields(fields)
+        if self.logger is not None:
+            # Report the caller of info() etc., not this module
+            getattr(self.logger, logging.getLevelName(level).lower())(message, extra=fields, stacklevel=4)
+            return
+        record = {"level": logging.getLevelName(level), "message": message}
+        if self.name:
+            record["logger"] = self.name
+        print(dumps({**record, **fields}), flush=True)
+
+    def debug(self, message, **fields):
+        self.log(logging.DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        self.log(logging.INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        self.log(logging.WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        self.log(logging.ERROR, message, **fields)
@@ -0,0 +1,50 @@
+import os
+
+# "array" keeps the BSON array of doubles, "float32" and "int8" store a packed
+# BSON binary vector (subtype 9). int8 vectors are scaled per vector so that
+# the largest component maps to 127, which preserves cosine similarity but
+# not euclidean distance or dot product. NumPy is imported on first use to keep
+# it off the cold start of functions that only send array query vectors.
+VECTOR_ENCODINGS = ("array", "float32", "int8")
+VECTOR_ENCODING = os.environ.get("VECTOR_ENCODING", "array")
+
+
+def quantize_int8(values):
+    """
+    Scalar-quantize a vector to int8 using its own max absolute value
+    """
+    import numpy as np
+
+    vector = np.asarray(values, dtype=np.float32)
+    scale = float(np.abs(vector).max()) or 1.0
+    return np.clip(np.rint(vector / scale * 127), -127, 127).astype(np.int8)
+
+
+def encode_vector(values, encoding=None):
+    """
+    Encode an embedding for storage or for a $vectorSearch queryVector
+    """
+    encoding = encoding or VECTOR_ENCODING
+    if encoding == "array":
+        return [float(v) for v in values]
+
+    import numpy as np
+    from bson.binary import Binary, BinaryVectorDtype
+
+    if encoding == "float32":
+        return Binary.from_vector(np.asarray(values, dtype=np.float32).tolist(), BinaryVectorDtype.FLOAT32)
+    if encoding == "int8":
+        return Binary.from_vector(quantize_int8(values).tolist(), BinaryVectorDtype.INT8)
+    raise ValueError(f"Unknown vector encoding {encoding!r}, expected one of {VECTOR_ENCODINGS}")
+
+
+def decode_vector(value):
+    """
+    Return a stored embedding as a float32 NumPy array, whatever its encoding
+    """
+    import numpy as np
+    from bson.binary import Binary
+
+    if isinstance(value, Binary):
+        return np.asarray(value.as_vector().data, dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
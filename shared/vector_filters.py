@@ -0,0 +1,66 @@
+import os
+
+from lookup_fields import BEST_MONTHS_FIELD, LOOKUP_FIELDS, month_name, normalize_lookup
+
+# Further document fields the semantic place search may filter on, comma-separated.
+# Each is indexed as a filter field of the vector index next to the country and best months
+VECTOR_FILTER_FIELDS = [field.strip() for field in os.environ.get("VECTOR_FILTER_FIELDS", "").split(",") if field.strip()]
+
+
+def filter_paths(extra_fields=None):
+    extra_fields = VECTOR_FILTER_FIELDS if extra_fields is None else extra_fields
+    return [LOOKUP_FIELDS["Country"], BEST_MONTHS_FIELD, *extra_fields]
+
+
+def vector_filter(country=None, month=None, fields=None, extra_fields=None):
+    """
+    $vectorSearch pre-filter for a country, a month among the best months to
+    visit and equality (or $in for lists) on further filter fields, None
+    without any. Raises ValueError for an unknown month or a field the vector
+    index does not filter on
+    """
+    extra_fields = VECTOR_FILTER_FIELDS if extra_fields is None else extra_fields
+    clauses = []
+    if country:
+        clauses.append({LOOKUP_FIELDS["Country"]: {"$eq": normalize_lookup(country)}})
+    if month:
+        name = month_name(month)
+        if name is None:
+            raise ValueError(f"{month!r} is not a month")
+        clauses.append({BEST_MONTHS_FIELD: {"$eq": name}})
+    if fields is not None and not isinstance(fields, dict):
+        raise ValueError("filters must be an object of field names and values")
+    for field, value in (fields or {}).items():
+        if field not in extra_fields:
+            raise ValueError(f"{field!r} is not a filter field of the vector index, expected one of {extra_fields}")
+        clauses.append({field: {"$in": value} if isinstance(value, list) else {"$eq": value}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def vector_index_definition(path, dimensions, similarity="cosine", extra_fields=None):
+    return {
+        "fields": [
+            {"type": "vector", "path": path, "numDimensions": dimensions, "similarity": similarity},
+            *({"type": "filter", "path": field} for field in filter_paths(extra_fields)),
+        ]
+    }
+
+
+def ensure_vector_index(collection, name, path, dimensions, similarity="cosine", extra_fields=None):
+    """
+    Create the vector search index with its filter fields, or update it when
+    its definition differs. Returns "created", "updated" or "unchanged"
+    """
+    from pymongo.operations import SearchIndexModel
+
+    definition = vector_index_definition(path, dimensions, similarity, extra_fields)
+    existing = next(iter(collection.list_search_indexes(name)), None)
+    if existing is None:
+        collection.create_search_index(SearchIndexModel(definition=definition, name=name, type="vectorSearch"))
+        return "created"
+    if existing.get("latestDefinition", {}).get("fields") == definition["fields"]:
+        return "unchanged"
+    collection.update_search_index(name, definition)
+    return "updated"
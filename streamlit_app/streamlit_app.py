@@ -1,6 +1,14 @@
+import codecs
+import time
+import uuid
+
 import streamlit as st
 import boto3
 
+# Messages kept per browser session, and the most recent of them rendered on every rerun
+MAX_HISTORY = 200
+MAX_RENDERED_MESSAGES = 50
+
 # Set page configuration
 st.set_page_config(
     page_title="MongoDB Atlas Travel Assistant",
@@ -12,39 +20,61 @@ st.set_page_config(
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Every browser session talks to its own agent session
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+@st.cache_resource
 def initialize_bedrock_agent_client():
-    """Initialize the Bedrock agent runtime client."""
+    """Initialize the Bedrock agent runtime client once, shared by all sessions."""
     return boto3.client(
         service_name="bedrock-agent-runtime",
         region_name="us-west-2"
     )
 
-def get_agent_response(agent_client, agent_id, user_input):
-    """Get response from the Bedrock agent."""
+def stream_agent_response(agent_client, agent_id, session_id, user_input, timing):
+    """
+    Yield the text of the Bedrock agent's response as its chunks arrive.
+    Records the time to the first token and in total in `timing`
+    """
+    start = time.perf_counter()
     try:
         response = agent_client.invoke_agent(
             agentId=agent_id,
             agentAliasId="<ALIASID>",  # You might need to adjust this
-            sessionId="streamlit-session",
-            inputText=user_input
+            sessionId=session_id,
+            inputText=user_input,
+            streamingConfigurations={"streamFinalResponse": True}
         )
         
-        # Extract the response from the agent
+        # Extract the response from the agent; a chunk may end inside a
+        # multi-byte character, so decode incrementally
         response_stream = response.get('completion')
-        if response_stream:
-            result = b''
-            for event in response_stream:
-                print(f"got event: {str(event)}")
-                chunk = event.get('chunk')
-                if chunk:
-                    result += chunk.get('bytes', b'')
-            
-            return result.decode('utf-8')
-        return "No response from agent"
+        if not response_stream:
+            yield "No response from agent"
+            return
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for event in response_stream:
+            chunk = event.get('chunk')
+            if chunk:
+                text = decoder.decode(chunk.get('bytes', b''))
+                if text:
+                    timing.setdefault('first_token', time.perf_counter() - start)
+                    yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
     
     except Exception as e:
         st.error(f"Error invoking Bedrock agent: {str(e)}")
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
+    finally:
+        timing['total'] = time.perf_counter() - start
+
+def format_timing(timing):
+    if 'first_token' not in timing:
+        return f"Answered in {timing['total']:.2f}s"
+    return f"First token in {timing['first_token']:.2f}s, answered in {timing['total']:.2f}s"
 
 # Main app
 def main():
@@ -62,12 +92,18 @@ def main():
         # Add a clear chat button
         if st.button("Clear Chat"):
             st.session_state.messages = []
+            st.session_state.session_id = uuid.uuid4().hex
             st.rerun()
     
-    # Display chat messages
-    for message in st.session_state.messages:
+    # Display the most recent chat messages
+    messages = st.session_state.messages
+    if len(messages) > MAX_RENDERED_MESSAGES:
+        st.caption(f"{len(messages) - MAX_RENDERED_MESSAGES} earlier messages hidden")
+    for message in messages[-MAX_RENDERED_MESSAGES:]:
         with st.chat_message(message["role"]):
             st.write(message["content"])
+            if "timing" in message:
+                st.caption(message["timing"])
     
     # Chat input
     if prompt := st.chat_input("Ask about travel destinations..."):
@@ -80,18 +116,19 @@ def main():
         
         # Display assistant response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                # Initialize Bedrock agent client
-                agent_client = initialize_bedrock_agent_client()
-                
-                # Get response from Bedrock agent
-                response = get_agent_response(agent_client, agent_id, prompt)
-                
-                # Display the response
-                st.write(response)
+            # Reuse the Bedrock agent client
+            agent_client = initialize_bedrock_agent_client()
+            
+            # Render the response from the Bedrock agent while it streams
+            timing = {}
+            response = st.write_stream(
+                stream_agent_response(agent_client, agent_id, st.session_state.session_id, prompt, timing))
+            timing_txt = format_timing(timing)
+            st.caption(timing_txt)
         
-        # Add assistant response to chat history
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        # Add assistant response to chat history, keeping only the latest messages
+        st.session_state.messages.append({"role": "assistant", "content": response, "timing": timing_txt})
+        del st.session_state.messages[:-MAX_HISTORY]
 
 if __name__ == "__main__":
     main()
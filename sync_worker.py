@@ -0,0 +1,85 @@
+import argparse
+import logging
+import os
+import signal
+import sys
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared'))
+from change_sync import ChangeSync, ResumeTokenStore
+from embedding_backfill import StubEmbedder, TitanEmbedder
+from embeddings import TITAN_MODEL_ID
+from vector_codec import VECTOR_ENCODINGS
+from atlas_client import get_secret
+
+logger = logging.getLogger('sync_worker')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Tail a collection's change stream and keep its embeddings and lookup fields up to date")
+    parser.add_argument("--uri", help="Connection string, instead of the Secrets Manager secret "
+                                      "(e.g. mongodb://localhost:27017/?directConnection=true)")
+    parser.add_argument("--db", default="travel")
+    parser.add_argument("--collection", default="asia")
+    parser.add_argument("--source-field", default="About Place", help="Field holding the text to embed")
+    parser.add_argument("--field", default="details_embedding", help="Field the embeddings are written to")
+    parser.add_argument("--no-lookup-fields", dest="lookup_fields", action="store_false",
+                        help="Do not maintain the normalized place lookup fields and best months")
+    parser.add_argument("--embedder", choices=["titan", "stub", "none"], default="titan",
+                        help="Bedrock Titan, deterministic local vectors, or no embeddings")
+    parser.add_argument("--model-id", default=TITAN_MODEL_ID)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Dimensions of the stub vectors")
+    parser.add_argument("--vector-encoding", choices=VECTOR_ENCODINGS, default="array")
+    parser.add_argument("--batch-size", type=int, default=100, help="Changed documents applied together")
+    parser.add_argument("--flush-ms", type=int, default=1000, help="Longest wait before applying a partial batch")
+    parser.add_argument("--workers", type=int, default=4, help="Embedding batches in flight")
+    parser.add_argument("--state-collection", default="sync_state",
+                        help="Collection of the same database holding the resume tokens")
+    parser.add_argument("--name", help="Name of this worker's resume token (default: <collection>.<field>)")
+    parser.add_argument("--catch-up", action="store_true",
+                        help="Make a full pass over the collection before tailing, e.g. on the first start")
+    args = parser.parse_args()
+    args.name = args.name or f"{args.collection}.{args.field}"
+    return args
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.uri:
+        client = MongoClient(args.uri)
+    else:
+        logger.info("Retrieving MongoDB connection string from Secrets Manager")
+        client = MongoClient(get_secret("workshop/atlas_secret"))  # Replace with your secret name
+    db = client[args.db]
+
+    embedder, model_id = None, None
+    if args.embedder == "stub":
+        embedder = StubEmbedder(args.dimensions)
+        model_id = embedder.model_id
+    elif args.embedder == "titan":
+        import boto3
+
+        embedder = TitanEmbedder(boto3.client('bedrock-runtime', region_name=args.region), args.model_id)
+        model_id = args.model_id
+
+    sync = ChangeSync(
+        db[args.collection], ResumeTokenStore(db[args.state_collection], args.name), embedder, model_id,
+        source_field=args.source_field, vector_field=args.field, vector_encoding=args.vector_encoding,
+        lookup_fields=args.lookup_fields, batch_size=args.batch_size, flush_ms=args.flush_ms, workers=args.workers,
+    )
+
+    stopping = []
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.append(True))
+
+    sync.run(lambda: bool(stopping), catch_up=args.catch_up)
+    logger.info(f"Stopped: {sync.stats()}")
+
+
+if __name__ == "__main__":
+    main()
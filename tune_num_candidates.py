@@ -0,0 +1,193 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared'))
+from search_settings import MAX_NUM_CANDIDATES, VECTOR_SEARCH_SETTINGS
+from vector_codec import decode_vector, encode_vector
+from atlas_client import get_secret
+
+logger = logging.getLogger('tune_num_candidates')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure $vectorSearch recall@k and latency against exact results across numCandidates "
+                    "values and record the smallest one reaching the target recall")
+    parser.add_argument("--db", default="travel")
+    parser.add_argument("--collection", default="asia")
+    parser.add_argument("--field", default="details_embedding", help="Field holding the embeddings")
+    parser.add_argument("--index", default="travel_vector_index", help="Vector search index on --field")
+    parser.add_argument("--similarity", choices=["cosine", "dotProduct", "euclidean"], default="cosine",
+                        help="Similarity function of the index")
+    parser.add_argument("--queries", type=int, default=100, help="Stored vectors sampled as queries")
+    parser.add_argument("--query-file", help="Embed the queries in this file (one per line) with Titan instead")
+    parser.add_argument("-k", type=int, nargs="+", default=[10], help="Limits to tune")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 20, 50, 100, 150, 200, 400, 800],
+                        help="numCandidates values swept")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of every query for the latency figures")
+    parser.add_argument("--output", default=VECTOR_SEARCH_SETTINGS, help="Settings file updated with the result")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the sweep, do not write settings")
+    return parser.parse_args()
+
+
+def load_vectors(collection, field):
+    ids, vectors = [], []
+    for doc in collection.find({field: {"$exists": True}}, {field: 1}, batch_size=1000):
+        ids.append(doc["_id"])
+        vectors.append(decode_vector(doc[field]))
+    return ids, np.vstack(vectors)
+
+
+def query_vectors(collection, field, count, query_file):
+    """
+    Embed the lines of `query_file` with Titan, or sample `count` stored vectors
+    """
+    if query_file:
+        import boto3
+        from embeddings import embed_titan
+
+        bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
+        with open(query_file) as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return np.vstack([np.asarray(embed_titan(bedrock_runtime, text), dtype=np.float32) for text in texts])
+    pipeline = [{"$match": {field: {"$exists": True}}}, {"$sample": {"size": count}}, {"$project": {field: 1}}]
+    return np.vstack([decode_vector(doc[field]) for doc in collection.aggregate(pipeline)])
+
+
+def exact_top_k(matrix, queries, k, similarity, chunk=16):
+    """
+    Row positions of the k nearest vectors of every query, by brute force
+    """
+    if similarity == "cosine":
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    tops = []
+    for start in range(0, len(queries), chunk):
+        block = queries[start:start + chunk]
+        if similarity == "euclidean":
+            scores = -(np.sum(matrix ** 2, axis=1) - 2 * block @ matrix.T)
+        else:
+            scores = block @ matrix.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        tops.extend(top)
+    return tops
+
+
+def vector_search(collection, index, field, vector, num_candidates, k):
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "index": index,
+                "path": field,
+                "queryVector": encode_vector(vector),
+                "numCandidates": num_candidates,
+                "limit": k,
+            }
+        },
+        {"$project": {"_id": 1}},
+    ]
+    start = time.perf_counter()
+    docs = list(collection.aggregate(pipeline))
+    return [doc["_id"] for doc in docs], (time.perf_counter() - start) * 1000
+
+
+def sweep(collection, args, truth, queries, k):
+    """
+    recall@k and latency of every numCandidates value for limit `k`
+    """
+    rows = []
+    for num_candidates in sorted({min(max(c, k), MAX_NUM_CANDIDATES) for c in args.candidates}):
+        recalls, latencies = [], []
+        for query, relevant in zip(queries, truth):
+            for _ in range(args.repeats):
+                found, ms = vector_search(collection, args.index, args.field, query, num_candidates, k)
+                latencies.append(ms)
+            recalls.append(len(set(found) & relevant) / k)
+        latencies.sort()
+        row = {
+            "numCandidates": num_candidates,
+            "recall": round(statistics.mean(recalls), 4),
+            "min_recall": round(min(recalls), 4),
+            "p50_ms": round(statistics.median(latencies), 2),
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+        }
+        logger.info(f"k={k} numCandidates={num_candidates}: recall@{k} {row['recall']:.3f} "
+                    f"(min {row['min_recall']:.2f}), p50 {row['p50_ms']:.1f}ms, p95 {row['p95_ms']:.1f}ms")
+        rows.append(row)
+    return rows
+
+
+def recommend(rows, target_recall):
+    """
+    Smallest numCandidates reaching the target recall, else the one with the best recall
+    """
+    for row in rows:
+        if row["recall"] >= target_recall:
+            return row
+    logger.warning(f"No numCandidates value reached recall {target_recall}, using the best one")
+    return max(rows, key=lambda row: (row["recall"], -row["numCandidates"]))
+
+
+def write_settings(path, namespace, entry):
+    settings = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            settings = json.load(f)
+    settings[namespace] = entry
+    with open(path, "w") as f:
+        json.dump(settings, f, indent=2)
+        f.write("\n")
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    logger.info("Retrieving MongoDB connection string from Secrets Manager")
+    client = MongoClient(get_secret("workshop/atlas_secret"))  # Replace with your secret name
+    collection = client[args.db][args.collection]
+
+    ids, matrix = load_vectors(collection, args.field)
+    queries = query_vectors(collection, args.field, args.queries, args.query_file)
+    logger.info(f"Loaded {len(ids)} vectors and {len(queries)} queries")
+
+    # Warm the index up so the first numCandidates value is not penalized
+    vector_search(collection, args.index, args.field, queries[0], max(args.candidates), max(args.k))
+
+    tuned, sweeps = {}, {}
+    for k in args.k:
+        truth = [{ids[row] for row in top} for top in exact_top_k(matrix, queries, k, args.similarity)]
+        rows = sweeps[str(k)] = sweep(collection, args, truth, queries, k)
+        best = recommend(rows, args.target_recall)
+        tuned[str(k)] = best["numCandidates"]
+        logger.info(f"k={k}: numCandidates {best['numCandidates']} (recall {best['recall']:.3f}, p95 {best['p95_ms']:.1f}ms)")
+
+    if args.dry_run:
+        return
+    namespace = f"{args.db}.{args.collection}"
+    write_settings(args.output, namespace, {
+        "index": args.index,
+        "path": args.field,
+        "similarity": args.similarity,
+        "target_recall": args.target_recall,
+        "numCandidates": tuned,
+        "documents": len(ids),
+        "queries": len(queries),
+        "tuned_at": datetime.now(timezone.utc).isoformat(),
+        "sweep": sweeps,
+    })
+    logger.info(f"Wrote the settings of {namespace} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()